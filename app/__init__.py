@@ -4,4 +4,10 @@ from app.config import Config
 app = Flask(__name__, static_url_path='/static')
 app.config.from_object(Config)
 
+from app import metrics
+metrics.init_app(app)
+
 from app import routes
+
+if app.config['PRELOAD']:
+    routes.preload()
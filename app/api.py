@@ -0,0 +1,79 @@
+"""
+The text tools as plain functions of their form data, for the json api
+Inputs are keyed like the tools' form fields and go through the same forms, so they
+are parsed and checked exactly as typed-in input is, e.g. {"dividend": "x**3 - 1",
+"divisor": "x - 1"} for poly_long_div.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app
+from app import metrics
+from app import tools
+from app.forms import IntegerLongDiv, PolynomialLongDiv, RationalRoots, SyntheticDivision, VerticalAddition
+from app.forms import VerticalSubtraction, read_form
+
+
+TEXT_TOOLS = {
+    'int_long_div': (IntegerLongDiv, lambda form: tools.int_long_division(form.dividend.parsed, form.divisor.parsed)),
+    'poly_long_div': (PolynomialLongDiv, lambda form: tools.poly_long_division(form.dividend.parsed,
+                                                                               form.divisor.parsed)),
+    'synth_div': (SyntheticDivision, lambda form: tools.synthetic_division(form.dividend.parsed, form.divisor.parsed)),
+    'vert_add': (VerticalAddition, lambda form: tools.vertical_addition(*form.addends.parsed)),
+    'vert_sub': (VerticalSubtraction, lambda form: tools.vertical_subtraction(*form.subtrahends.parsed)),
+    'rational_roots': (RationalRoots, lambda form: tools.rational_roots(form.polynomial.parsed)),
+}
+
+
+def evaluate(tool, data):
+    """{'latex': ...} for the tool on data, or {'errors': ...} by field if data isn't valid input"""
+    if not isinstance(data, dict):
+        return {'errors': {'input': ['expected an object of form fields']}}
+    form_class, latex = TEXT_TOOLS[tool]
+    with app.app_context():
+        form = read_form(form_class, data)
+    if form.errors:
+        return {'errors': form.errors}
+    with metrics.stage('latex'):
+        return {'latex': latex(form)}
+
+
+def evaluate_all(tool, inputs):
+    return [evaluate(tool, data) for data in inputs]
+
+
+class TextPool(object):
+    """
+    Evaluates batches of text tool inputs across worker processes
+    Inputs go to the workers in chunks, a few per worker, so a batch of hundreds
+    costs a handful of round trips; batches too small to share run in process.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # Spawned for the same reason as the render jobs' pool, the children don't inherit threads
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.processes,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def evaluate(self, tool, inputs):
+        """evaluate for every input, in order"""
+        if self.processes < 2 or len(inputs) < 2 * self.processes:
+            return evaluate_all(tool, inputs)
+
+        size = -(-len(inputs) // (4 * self.processes))
+        chunks = [inputs[i:i + size] for i in range(0, len(inputs), size)]
+        results = []
+        for outcome in self._executor().map(metrics.run, [evaluate_all] * len(chunks), [tool] * len(chunks), chunks):
+            results.extend(metrics.unpack(outcome))
+        return results
+
+
+pool = TextPool(app.config['API_PROCESSES'])
@@ -0,0 +1,287 @@
+"""
+Renders a job file of figures and text tool answers offline, without the web app
+Each job names a tool and gives its form fields like the /batch and /api inputs do, with
+an optional id and renderer, one json object per line or one csv row under a header:
+
+    {"id": "fig-1", "tool": "factor_tree", "function": "360"}
+    {"tool": "num_line_inequality", "first": "-5", "last": "5", "relation": "-2 < x <= 3", "renderer": "svg"}
+    {"tool": "poly_long_div", "dividend": "x**3 - 1", "divisor": "x - 1"}
+
+Jobs go to a process pool in chunks of one tool and renderer, so each chunk's figures
+compile as the pages of one TeX run, and a few chunks are kept in flight while the input is
+still being read. Figures are written to <out>/<id>.svg and text answers to <out>/<id>.tex,
+each job's outcome is appended to <out>/manifest.jsonl as it finishes, and running again
+with the same out directory skips every job the manifest records as done.
+
+    python -m app.cli jobs.jsonl --out figures [--processes 4] [--renderer svg]
+    python -m app.cli - --format csv --out figures < jobs.csv
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from app import app
+
+MANIFEST = 'manifest.jsonl'
+# Ids become file names, so they're kept to these characters
+ID = re.compile(r'[\w][\w.-]*')
+
+
+def read_jobs(file, fmt):
+    """
+    Yields (line, record) for every job in the file, skipping blank lines
+    A job reusing an earlier one's id would overwrite its files and manifest entry, so it
+    comes back as an error naming both lines instead.
+    """
+    seen = {}
+    for line, record in parse_jobs(file, fmt):
+        if isinstance(record, dict) and 'error' not in record:
+            job_id = str(record.get('id', '%06d' % line))
+            if job_id in seen:
+                yield line, {'error': f'duplicate id {job_id!r}, already used on line {seen[job_id]}'}
+                continue
+            seen[job_id] = line
+        yield line, record
+
+
+def parse_jobs(file, fmt):
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(file), 2):
+            # Empty cells are fields the job doesn't use
+            yield line, {name: value for name, value in row.items() if name and value not in (None, '')}
+        return
+    for line, text in enumerate(file, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError as e:
+            yield line, {'error': f'invalid json: {e}'}
+
+
+def finished(out):
+    """Ids the manifest in out records as done whose files are still there"""
+    done = set()
+    try:
+        with open(out / MANIFEST) as manifest:
+            for text in manifest:
+                try:
+                    entry = json.loads(text)
+                except ValueError:
+                    # The last line of a run that was killed mid-write
+                    continue
+                if entry.get('status') == 'done' and (out / entry['file']).exists():
+                    done.add(entry['id'])
+                else:
+                    done.discard(entry.get('id'))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def save(path, write):
+    """Writes a file through write(file), renaming it into place whole so a resumed run never sees half of it"""
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            write(file)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def done(job, name):
+    return {'id': job['id'], 'tool': job['tool'], 'status': 'done', 'file': name}
+
+
+def failed(job, errors):
+    return {'id': job['id'], 'tool': job.get('tool'), 'status': 'failed', 'errors': errors}
+
+
+def text_chunk(tool, jobs, out):
+    from app import api
+
+    entries = []
+    for job in jobs:
+        result = api.evaluate(tool, job['fields'])
+        if 'errors' in result:
+            entries.append(failed(job, result['errors']))
+            continue
+        name = f"{job['id']}.tex"
+        save(out / name, lambda file: file.write(result['latex'] + '\n'))
+        entries.append(done(job, name))
+    return entries
+
+
+def image_chunk(tool, jobs, out):
+    """Renders a chunk of one image tool's jobs with one renderer, all in one TeX run if they can be"""
+    from app import cost, parse, render
+    from app.forms import read_form
+    from app.routes import IMAGE_INPUTS
+    from app.texpool import TexError
+
+    form_class, arguments = IMAGE_INPUTS[tool]
+    entries, ready = [], []
+    with app.app_context():
+        for job in jobs:
+            form = read_form(form_class, job['fields'])
+            if form.errors:
+                entries.append(failed(job, form.errors))
+                continue
+            try:
+                ready.append((job, form.renderer.data, cost.admit(tool, arguments(form))))
+            except parse.ParseError as e:
+                entries.append(failed(job, {'input': [str(e)]}))
+            except cost.TooExpensive as e:
+                entries.append(failed(job, {'input': [str(e)]}))
+
+    def copy(job, url):
+        name = f"{job['id']}.svg"
+        svg = render.svg_at(url).decode('utf-8')
+        save(out / name, lambda file: file.write(svg))
+        return done(job, name)
+
+    for renderer, group in itertools.groupby(ready, key=lambda item: item[1]):
+        group = list(group)
+        try:
+            urls = render.render_figures(tool, [args for _, _, args in group], renderer)
+            entries += [copy(job, url) for (job, _, _), url in zip(group, urls)]
+        except TexError:
+            # One figure TeX fails on fails the whole run, so find which by rendering them one at a time
+            for job, _, args in group:
+                try:
+                    entries.append(copy(job, render.render_figures(tool, [args], renderer)[0]))
+                except TexError as e:
+                    entries.append(failed(job, {'render': [str(e)]}))
+    return entries
+
+
+def run_chunk(tool, jobs, out):
+    """The manifest entries for a chunk of jobs of one tool, in the order they finished"""
+    from app import api
+    from app.routes import IMAGE_INPUTS
+
+    if tool in api.TEXT_TOOLS:
+        return text_chunk(tool, jobs, out)
+    if tool in IMAGE_INPUTS:
+        return image_chunk(tool, jobs, out)
+    return [failed(job, {'tool': [f'unknown tool {tool!r}']}) for job in jobs]
+
+
+def init_worker():
+    # Every worker process drives its own TeX worker, the pool is already as wide as the cores
+    app.config['TEX_POOL_SIZE'] = 1
+
+
+def chunks(records, skip, renderer, size):
+    """
+    Yields (tool, jobs) chunks of up to size jobs for one tool and renderer, in input order as far
+    as chunks allow, and (None, [entry]) for a record that can't be a job
+    """
+    pending = {}
+    for line, record in records:
+        if not isinstance(record, dict):
+            yield None, [failed({'id': '%06d' % line}, {'input': ['expected an object of form fields']})]
+            continue
+        fields = dict(record)
+        job = {'id': str(fields.pop('id', '%06d' % line)), 'tool': fields.pop('tool', None), 'fields': fields}
+        if job['id'] in skip:
+            continue
+        if 'error' in fields:
+            yield None, [failed(job, {'input': [fields['error']]})]
+            continue
+        if not ID.fullmatch(job['id']):
+            yield None, [failed(job, {'id': ['may only have letters, digits, _, - and . and not start with .']})]
+            continue
+        fields.setdefault('renderer', renderer)
+        key = (job['tool'], fields['renderer'])
+        pending.setdefault(key, []).append(job)
+        if len(pending[key]) >= size:
+            yield job['tool'], pending.pop(key)
+    for (tool, _), jobs in pending.items():
+        yield tool, jobs
+
+
+def render_all(records, out, processes, renderer='tex', chunk_size=32):
+    """
+    Runs every job not already done in out, appending each outcome to the manifest
+    Returns how many jobs were done and failed.
+    """
+    out.mkdir(parents=True, exist_ok=True)
+    skip = finished(out)
+    counts = {'done': 0, 'failed': 0}
+
+    with open(out / MANIFEST, 'a+', encoding='utf-8') as manifest:
+        # A run killed mid-write leaves a partial last line, which is started afresh after
+        if manifest.tell() > 0:
+            manifest.seek(manifest.tell() - 1)
+            if manifest.read(1) != '\n':
+                manifest.write('\n')
+
+        def record(entries):
+            for entry in entries:
+                counts[entry['status']] += 1
+                manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+
+        work = chunks(records, skip, renderer, chunk_size)
+        if processes < 2:
+            for tool, jobs in work:
+                record(jobs if tool is None else run_chunk(tool, jobs, out))
+            return counts
+
+        def collect(future):
+            try:
+                record(future.result())
+            except Exception as e:
+                # A worker that died takes its whole chunk with it, to be retried on the next run
+                record(failed(job, {'render': [repr(e)]}) for job in pending.pop(future))
+            else:
+                del pending[future]
+
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker) as executor:
+            pending = {}
+            for tool, jobs in work:
+                if tool is None:
+                    record(jobs)
+                    continue
+                pending[executor.submit(run_chunk, tool, jobs, out)] = jobs
+                if len(pending) >= 2 * processes:
+                    for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                        collect(future)
+            for future in wait(pending).done:
+                collect(future)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.cli', description=__doc__.splitlines()[1])
+    parser.add_argument('jobs', nargs='?', default='-', help='job file, or - for stdin (the default)')
+    parser.add_argument('--out', required=True, help='directory for the figures, answers and manifest')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='of the job file, by default from its extension')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--renderer', choices=['tex', 'svg'], default=app.config['DEFAULT_RENDERER'],
+                        help='for figures whose job does not name one')
+    parser.add_argument('--chunk-size', type=int, default=32, help='jobs sent to a worker at a time')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.jobs.lower().endswith('.csv') else 'jsonl')
+    file = sys.stdin if args.jobs == '-' else open(args.jobs, newline='', encoding='utf-8')
+    with file:
+        counts = render_all(read_jobs(file, fmt), Path(args.out), args.processes, args.renderer, args.chunk_size)
+    print(f"{counts['done']} done, {counts['failed']} failed, see {Path(args.out) / MANIFEST}", file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,88 @@
 import os
+import tempfile
+
+basedir = os.path.abspath(os.path.dirname(__file__))
 
 
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
+
+    # Rendered images are stored by content hash and served from /renders (see app.store): 'disk' keeps them as files
+    # in RENDER_CACHE_DIR, which nodes can share, 'sqlite' in the database at RENDER_STORE_PATH
+    RENDER_STORE = os.environ.get('RENDER_STORE') or 'disk'
+    RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR') or os.path.join(basedir, 'renders')
+    RENDER_STORE_PATH = os.environ.get('RENDER_STORE_PATH') or os.path.join(basedir, 'renders.sqlite3')
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+    # Seconds between sweeps that trim the store back under RENDER_CACHE_MAX_BYTES
+    RENDER_REAP_INTERVAL = float(os.environ.get('RENDER_REAP_INTERVAL') or 60)
+    # Seconds a worker may hold a figure it is rendering before another may take it over
+    RENDER_LEASE = float(os.environ.get('RENDER_LEASE') or 300)
+    # Where compiles get their temporary directories, a tmpfs when there is one
+    RENDER_SCRATCH_DIR = os.environ.get('RENDER_SCRATCH_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+    # Warm TeX workers kept per image template, and how many jobs each may have waiting
+    TEX_POOL_SIZE = int(os.environ.get('TEX_POOL_SIZE') or 2)
+    TEX_QUEUE_DEPTH = int(os.environ.get('TEX_QUEUE_DEPTH') or 16)
+    TEX_JOB_TIMEOUT = float(os.environ.get('TEX_JOB_TIMEOUT') or 30)
+    # Engine compiling the image templates, one of app.engines.ENGINES or 'auto' for the first installed,
+    # overridden per template with e.g. TEX_ENGINES='plotter=lualatex+pdf2svg,factor_tree=latex+dvisvgm'
+    TEX_ENGINE = os.environ.get('TEX_ENGINE') or 'auto'
+    TEX_ENGINES = dict(pair.strip().split('=', 1) for pair in (os.environ.get('TEX_ENGINES') or '').split(',')
+                       if pair.strip())
+    # With 'auto', time every installed engine on sample figures when a template's workers start and keep the fastest
+    TEX_ENGINE_BENCHMARK = (os.environ.get('TEX_ENGINE_BENCHMARK') or '').lower() in ('1', 'true', 'yes')
+
+    # Limits on every TeX and converter process besides the timeout: bytes of memory, and bytes written to any one file
+    TEX_MAX_MEMORY = int(os.environ.get('TEX_MAX_MEMORY') or 2 * 1024 * 1024 * 1024)
+    TEX_MAX_OUTPUT = int(os.environ.get('TEX_MAX_OUTPUT') or 64 * 1024 * 1024)
+
+    # Figures estimated to have more lines, points and glyphs than this are refused (see app.cost),
+    # after a number line's step is chosen to give it at most NUMBER_LINE_MAX_TICKS ticks
+    RENDER_MAX_ELEMENTS = int(os.environ.get('RENDER_MAX_ELEMENTS') or 50000)
+    NUMBER_LINE_MAX_TICKS = int(os.environ.get('NUMBER_LINE_MAX_TICKS') or 41)
+
+    # Most figures a single /batch request may ask for
+    RENDER_BATCH_MAX = int(os.environ.get('RENDER_BATCH_MAX') or 100)
+
+    # 'tex' compiles the image tools' figures with a TeX engine, 'svg' draws them in process
+    DEFAULT_RENDERER = os.environ.get('DEFAULT_RENDERER') or 'tex'
+
+    # Processes rendering images in the background, and how many jobs may wait for them before requests get a 429
+    RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES') or os.cpu_count() or 1)
+    RENDER_JOB_QUEUE_DEPTH = int(os.environ.get('RENDER_JOB_QUEUE_DEPTH') or 32)
+
+    # Processes evaluating /api/v1 batches, the most inputs per batch, and how long clients may cache results
+    API_PROCESSES = int(os.environ.get('API_PROCESSES') or os.cpu_count() or 1)
+    API_BATCH_MAX = int(os.environ.get('API_BATCH_MAX') or 1000)
+    API_MAX_AGE = int(os.environ.get('API_MAX_AGE') or 24 * 60 * 60)
+
+    # Text tool results remembered in process, and a directory to share them between workers through,
+    # trimmed back to MEMO_DIR_MAX_BYTES by dropping the least recently used every RENDER_REAP_INTERVAL seconds
+    MEMO_MAX_ENTRIES = int(os.environ.get('MEMO_MAX_ENTRIES') or 4096)
+    MEMO_DIR = os.environ.get('MEMO_DIR') or None
+    MEMO_DIR_MAX_BYTES = int(os.environ.get('MEMO_DIR_MAX_BYTES') or 64 * 1024 * 1024)
+    # Part of every memo key, so results written by other code are never served from a shared MEMO_DIR.
+    # By default a hash of the sources that write the LaTeX, set it to share entries across releases on purpose
+    MEMO_VERSION = os.environ.get('MEMO_VERSION') or None
+
+    # Limits on form and api input: characters, nesting, polynomial degree, digits in any number, and seconds to parse
+    PARSE_MAX_LENGTH = int(os.environ.get('PARSE_MAX_LENGTH') or 2000)
+    PARSE_MAX_DEPTH = int(os.environ.get('PARSE_MAX_DEPTH') or 32)
+    PARSE_MAX_DEGREE = int(os.environ.get('PARSE_MAX_DEGREE') or 64)
+    PARSE_MAX_DIGITS = int(os.environ.get('PARSE_MAX_DIGITS') or 2000)
+    PARSE_DEADLINE = float(os.environ.get('PARSE_DEADLINE') or .25)
+
+    # Most candidates /rational_roots will test, two for every divisor of the constant times every divisor of the lead
+    RATIONAL_ROOTS_MAX_CANDIDATES = int(os.environ.get('RATIONAL_ROOTS_MAX_CANDIDATES') or 20000)
+
+    # Import sympy, numpy and the tools at startup instead of on first use, for servers that load the app before forking
+    PRELOAD = (os.environ.get('PRELOAD') or '').lower() in ('1', 'true', 'yes')
+
+    # Log every request as a json line with its stage timings, and profile this fraction of requests into PROFILE_DIR
+    REQUEST_LOG = (os.environ.get('REQUEST_LOG') or '').lower() in ('1', 'true', 'yes')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'sme_profiles')
+
+    # Most problems one /worksheet request may ask for, and the processes generating them
+    WORKSHEET_MAX_PROBLEMS = int(os.environ.get('WORKSHEET_MAX_PROBLEMS') or 100000)
+    WORKSHEET_PROCESSES = int(os.environ.get('WORKSHEET_PROCESSES') or os.cpu_count() or 1)
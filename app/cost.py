@@ -0,0 +1,96 @@
+"""
+Estimates how big a figure will be from its arguments, before anything is drawn
+A figure's cost is the number of things in its svg: lines, circles and plotted points,
+plus a glyph for every character of every label, since that is what TeX and pdf2svg spend
+their time on. admit runs before a figure is rendered: it picks the step of a number line
+so it has at most NUMBER_LINE_MAX_TICKS ticks, and refuses anything still above RENDER_MAX_ELEMENTS
+with a TooExpensive explaining why.
+"""
+from math import log10
+
+from app import app
+from app import factor
+from app import metrics
+from app import plotting
+from app import ticks
+
+LOG10_2 = log10(2)
+# Most points app.plotting samples for one function
+PLOT_MAX_POINTS = 4000
+# Axes, grid, tick marks and their labels of the plotter template
+PLOT_AXES = 250
+
+
+class TooExpensive(ValueError):
+    """Raised with a message for the user when a figure would be too big to render"""
+
+
+def digits(n):
+    """Decimal digits of the integer n, from its bit length so it costs nothing for huge n"""
+    return int(abs(n).bit_length() * LOG10_2) + 1 + (n < 0)
+
+
+def number_line(first, last, solution, step=None):
+    if step is None:
+        step = ticks.step_for(first, last)
+    count = ticks.count(first, last, step)
+    places = ticks.decimals(step)
+    # The axis and its tips, a tick and at most a label per step, and per interval its line,
+    # its tips and the labels of its ends
+    return 3 + count * (2 + max(digits(int(first)), digits(int(last))) + places) + \
+        sum(3 + len(str(interval.low)) + len(str(interval.high)) for interval in solution)
+
+
+def factor_tree(number):
+    try:
+        node = factor.factor_tree(number)
+    except factor.FactorError:
+        raise TooExpensive('can only draw factor trees of numbers whose prime factors are at most about 12 digits')
+    # Every split is two edges, a circle round the prime and the labels of both
+    elements = digits(node.value)
+    while node.children:
+        prime, node = node.children
+        elements += 3 + digits(prime.value) + digits(node.value)
+    return elements + 1
+
+
+def plot(f):
+    return PLOT_AXES + len(plotting.as_functions(f)) * PLOT_MAX_POINTS
+
+
+# What each image tool's figure costs given its arguments
+ESTIMATES = {
+    'factor_tree': factor_tree,
+    'plotter': plot,
+    'num_line_inequality': number_line,
+}
+
+
+def downsample_number_line(first, last, solution, step=None):
+    if step is None:
+        step = ticks.step_for(first, last, app.config['NUMBER_LINE_MAX_TICKS'])
+    return first, last, solution, step
+
+
+# Arguments for a cheaper version of the same figure, for the tools that have one
+DOWNSAMPLE = {
+    'num_line_inequality': downsample_number_line,
+}
+
+
+def admit(tool, args):
+    """
+    The arguments to render the tool's figure with, downsampled where the tool allows
+    Raises TooExpensive if the figure would still have more than RENDER_MAX_ELEMENTS elements.
+    """
+    if tool in DOWNSAMPLE:
+        args = DOWNSAMPLE[tool](*args)
+    try:
+        elements = ESTIMATES[tool](*args)
+        if elements > app.config['RENDER_MAX_ELEMENTS']:
+            raise TooExpensive(f"would be too big to draw, about {elements} elements where "
+                               f"{app.config['RENDER_MAX_ELEMENTS']} are allowed")
+    except TooExpensive:
+        metrics.registry.inc('sme_renders_refused_total', tool=tool)
+        raise
+    return args
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Digit arrays for the vertical arithmetic and long division tools
+Every operand is turned into its digits once and the carries, borrows and partial
+remainders are worked out column by column in a single pass, using Python ints
+throughout so operands with thousands of digits stay exact.
+"""
+
+
+def digits(n):
+    """The digits of a non-negative integer, most significant first"""
+    return [int(digit) for digit in str(int(n))]
+
+
+def carries(addends):
+    """
+    The carry out of every column of the sum of addends
+    Returns a list with one entry per column, most significant first, so that
+    entry k is the carry written above column k + 1 counting from the left.
+    """
+    columns = [digits(addend)[::-1] for addend in addends]
+    width = max(len(column) for column in columns)
+    out = [0] * width
+    carry = 0
+    for place in range(width):
+        carry = (carry + sum(column[place] for column in columns if place < len(column))) // 10
+        out[width - 1 - place] = carry
+    return out
+
+
+def borrows(a, b):
+    """
+    The values each digit of a takes on while subtracting b, most significant first
+    Each entry starts with the original digit, then lists what it was crossed out
+    and replaced with: lowered by one when lending to the column on its right, raised
+    by ten when borrowing from the left. A run of zeros lending across goes straight
+    from 0 to 9, so no digit ever needs more than two replacements.
+    """
+    current = digits(a)
+    lower = digits(b)
+    lower = [0] * (len(current) - len(lower)) + lower
+    history = [[digit] for digit in current]
+
+    for i in range(len(current) - 1, -1, -1):
+        if current[i] >= lower[i]:
+            continue
+        # Find the nearest column on the left with something to lend
+        j = i - 1
+        while j >= 0 and current[j] == 0:
+            j -= 1
+        if j < 0:
+            break
+        current[j] -= 1
+        history[j].append(current[j])
+        for k in range(j + 1, i):
+            current[k] = 9
+            history[k].append(9)
+        current[i] += 10
+        history[i].append(current[i])
+    return history
+
+
+def long_division(a, d):
+    """
+    Schoolbook long division of a by d
+    Returns one (partial dividend, product subtracted) pair per digit of the
+    quotient, top to bottom, and the final remainder.
+    """
+    a_digits = str(int(a))
+    q = str(int(a) // int(d))
+    # The first partial dividend is every digit of a that sits left of the quotient's second digit
+    used = len(a_digits) - len(q) + 1
+    partial = int(a_digits[:used])
+    steps = []
+    for i, digit in enumerate(q):
+        product = int(d) * int(digit)
+        steps.append((partial, product))
+        partial -= product
+        if i + 1 < len(q):
+            partial = partial * 10 + int(a_digits[used + i])
+    return steps, partial
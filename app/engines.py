@@ -0,0 +1,166 @@
+"""
+The TeX engines figures can be compiled with, and choosing one per template
+Each engine is a TeX binary and the converter that turns its output into one svg per page:
+xelatex, pdflatex or lualatex through pdf2svg, or latex through dvisvgm, which skips the pdf.
+At startup every engine is checked for on the PATH, and a template uses the one configured
+for it or else the first installed. Optionally the installed engines all compile a sample
+figure and the template keeps the fastest that produced it, remembered in a small json file
+so every worker process doesn't benchmark again.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from app.texpool import TexError, TexWorkerPool
+
+log = logging.getLogger(__name__)
+
+
+class Engine(object):
+    """
+    A TeX binary and its svg converter
+    output is the file the binary writes ('pdf' or 'dvi'), driver the pgf driver it needs when
+    that isn't the binary's default, and dumps_format whether mylatexformat can precompile
+    a preamble for it (it can't for lualatex, whose formats don't keep the Lua state).
+    """
+
+    def __init__(self, name, program, converter, output='pdf', driver=None, dumps_format=True):
+        self.name = name
+        self.program = program
+        self.converter = converter
+        self.output = output
+        self.driver = driver
+        self.dumps_format = dumps_format
+
+    def __repr__(self):
+        return f'Engine({self.name!r})'
+
+    @property
+    def binaries(self):
+        return self.program, self.converter
+
+    def installed(self):
+        return all(shutil.which(binary) for binary in self.binaries)
+
+    def preamble(self, text):
+        """The template's preamble as this engine needs it"""
+        if self.driver is None:
+            return text
+        # Set before the class loads tikz, and passed to standalone so it crops the pages for dvisvgm
+        text = re.sub(r'\\documentclass\[', r'\\documentclass[%s, ' % self.driver, text, count=1)
+        return '\\def\\pgfsysdriver{pgfsys-%s.def}\n' % self.driver + text
+
+    def format_command(self, name):
+        return [self.program, '-ini', '-interaction=batchmode', f'-jobname={name}',
+                f'&{self.program}', 'mylatexformat.ltx', f'{name}.tex']
+
+    def compile_command(self, filename, fmt=None):
+        command = [self.program, '-interaction=nonstopmode', '-halt-on-error']
+        if fmt is not None:
+            command.append(f'-fmt={fmt}')
+        return command + [f'{filename}.tex']
+
+    def convert_command(self, filename):
+        """Splits every page of the output into <filename>_<page>.svg in a single pass"""
+        if self.converter == 'dvisvgm':
+            # Glyphs as paths like pdf2svg draws them, so the svgs don't depend on fonts
+            return ['dvisvgm', '--no-fonts', '--page=1-', f'--output={filename}_%p.svg', f'{filename}.dvi']
+        return ['pdf2svg', f'{filename}.{self.output}', f'{filename}_%d.svg', 'all']
+
+
+# In order of preference when a template has no engine configured
+ENGINES = {engine.name: engine for engine in (
+    Engine('xelatex+pdf2svg', 'xelatex', 'pdf2svg'),
+    Engine('pdflatex+pdf2svg', 'pdflatex', 'pdf2svg'),
+    Engine('latex+dvisvgm', 'latex', 'dvisvgm', output='dvi', driver='dvisvgm'),
+    Engine('lualatex+pdf2svg', 'lualatex', 'pdf2svg', dumps_format=False),
+)}
+
+
+@lru_cache(maxsize=None)
+def installed():
+    """Names of the engines whose binaries are all on the PATH, probed once per process"""
+    found = [name for name, engine in ENGINES.items() if engine.installed()]
+    log.info('TeX engines installed: %s', ', '.join(found) or 'none')
+    return tuple(found)
+
+
+def benchmark(template, bodies, names, timeout, scratch=None, repeats=3):
+    """
+    Seconds each engine in names takes to compile bodies with template, best of repeats
+    An engine that fails or times out is left out. Dumping the format isn't counted.
+    """
+    timings = {}
+    for name in names:
+        pool = TexWorkerPool(template, 1, 1, timeout, scratch, ENGINES[name])
+        try:
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                for svg in pool.render_batch(bodies):
+                    os.remove(svg)
+                seconds = time.perf_counter() - start
+                best = seconds if best is None else min(best, seconds)
+            timings[name] = best
+        except TexError as e:
+            log.warning('%s failed on %s: %s', name, Path(template).name, e)
+        finally:
+            pool.close()
+    return timings
+
+
+def choose(template, name='auto', bodies=None, timeout=30, scratch=None):
+    """
+    The engine to compile template with
+    name picks one outright, 'auto' the first installed, unless sample bodies are given, in which
+    case every installed engine is benchmarked on them and the fastest wins. Raises TexError when
+    the engine asked for, or every engine, is missing.
+    """
+    found = installed()
+    if name != 'auto':
+        if name not in ENGINES:
+            raise TexError(f'unknown TeX engine {name!r}, expected one of {", ".join(ENGINES)}')
+        if name not in found:
+            raise TexError(f'{name} needs {" and ".join(ENGINES[name].binaries)} on the PATH')
+        return ENGINES[name]
+    if not found:
+        raise TexError(f'no TeX engine is installed, tried {", ".join(ENGINES)}')
+    if not bodies or len(found) == 1:
+        return ENGINES[found[0]]
+
+    results = Path(scratch or tempfile.gettempdir()) / 'sme_engines.json'
+    preamble = Path(template).read_text()
+    key = hashlib.sha256('\0'.join((preamble, *bodies, *found)).encode('utf-8')).hexdigest()
+    try:
+        timings = json.loads(results.read_text()).get(key)
+    except (OSError, ValueError):
+        timings = None
+    if timings is None:
+        timings = benchmark(template, bodies, found, timeout, scratch)
+        save(results, key, timings)
+    log.info('%s: %s', Path(template).name,
+             ', '.join('%s %.0fms' % (name, seconds * 1000) for name, seconds in sorted(timings.items(),
+                                                                                       key=lambda item: item[1])))
+    if not timings:
+        raise TexError(f'no installed TeX engine could compile {Path(template).name}')
+    return ENGINES[min(timings, key=timings.get)]
+
+
+def save(path, key, timings):
+    """Adds one benchmark to the results file, replacing it whole so readers never see half of it"""
+    try:
+        saved = json.loads(path.read_text())
+    except (OSError, ValueError):
+        saved = {}
+    saved[key] = timings
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=path.parent)
+    with os.fdopen(fd, 'w') as file:
+        json.dump(saved, file)
+    os.replace(tmp, path)
@@ -0,0 +1,152 @@
+# coding=utf-8
+"""
+Integer factorization for the factor tree tools
+Small factors come off by trial division against a cached sieve, whatever is left
+is split with Pollard's rho (Brent's variant) and checked with Miller-Rabin, all in
+exact integer arithmetic. Rho gives up after RHO_MAX_STEPS, so a number with only
+huge prime factors raises FactorError in about a second instead of running for years.
+Nothing is shared between calls but the sieve and the trees already made, so the
+functions are safe to use from any number of threads.
+"""
+from collections import namedtuple
+from functools import lru_cache
+from math import gcd, isqrt
+
+# Bases that make Miller-Rabin deterministic below 3.3e24, and very nearly so above
+WITNESSES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+SIEVE_LIMIT = 1 << 16
+# Enough for rho to find any factor up to about 12 digits
+RHO_MAX_STEPS = 1 << 19
+
+
+class FactorError(ValueError):
+    """Raised when a number has no prime factor small enough to find within the step budget"""
+
+
+@lru_cache(maxsize=None)
+def small_primes(limit=SIEVE_LIMIT):
+    """The primes below limit, by the sieve of Eratosthenes"""
+    sieve = bytearray([1]) * limit
+    sieve[:2] = b'\x00\x00'
+    for p in range(2, isqrt(limit - 1) + 1):
+        if sieve[p]:
+            sieve[p * p::p] = bytes(len(range(p * p, limit, p)))
+    return tuple(p for p in range(limit) if sieve[p])
+
+
+def is_prime(n):
+    """Miller-Rabin primality test"""
+    if n < 2:
+        return False
+    for p in WITNESSES:
+        if n % p == 0:
+            return n == p
+
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    for a in WITNESSES:
+        y = pow(a, d, n)
+        if y == 1 or y == n - 1:
+            continue
+        for _ in range(s - 1):
+            y = y * y % n
+            if y == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def pollard_rho(n, max_steps=RHO_MAX_STEPS):
+    """
+    A nontrivial divisor of the odd composite n, by Brent's variant of Pollard's rho
+    Differences are multiplied together and checked with one gcd per hundred steps,
+    backtracking one step at a time if a batch overshoots to n. Raises FactorError
+    after max_steps steps in all.
+    """
+    steps = 0
+    for c in range(1, n):
+        y, r, q, g = 2, 1, 1, 1
+        while g == 1:
+            if steps > max_steps:
+                raise FactorError('%d has no prime factor small enough to find quickly' % n)
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(100, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = gcd(q, n)
+                k += 100
+            steps += 2 * r
+            r *= 2
+        if g == n:
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = gcd(abs(x - ys), n)
+        if g != n:
+            return g
+    raise ValueError('no divisor found for %d' % n)
+
+
+def prime_factors(n):
+    """The prime factors of n > 0 in ascending order, repeated by multiplicity"""
+    n = int(n)
+    factors = []
+    for p in small_primes():
+        if p * p > n:
+            break
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+
+    # Anything left has no factor below the sieve limit
+    pending = [n] if n > 1 else []
+    while pending:
+        m = pending.pop()
+        if m < SIEVE_LIMIT * SIEVE_LIMIT or is_prime(m):
+            factors.append(m)
+        else:
+            d = pollard_rho(m)
+            pending.extend([d, m // d])
+    return sorted(factors)
+
+
+# A node of a factor tree: its value and either no children or the (prime, cofactor) split
+Node = namedtuple('Node', ['value', 'children'])
+
+
+@lru_cache(maxsize=1024)
+def factor_tree(n):
+    """
+    The factor tree of n
+    Every level splits off the smallest prime factor as a leaf on the left and
+    continues with the cofactor on the right. Primes, 0 and 1 are single leaves.
+    """
+    n = int(n)
+    factors = prime_factors(n) if n > 1 else []
+    # Built from the bottom up, the last prime being the deepest leaf
+    node = Node(factors[-1] if factors else n, ())
+    value = node.value
+    for p in reversed(factors[:-1]):
+        value *= p
+        node = Node(value, (Node(p, ()), node))
+    return node
+
+
+def forest(node):
+    """Bracket syntax for the forest package, circling every prime"""
+    # Walked down the cofactors rather than recursing, so long chains of small primes are fine
+    text = ""
+    depth = 0
+    while node.children:
+        prime, cofactor = node.children
+        text += "[%d [%d,circle, draw] " % (node.value, prime.value)
+        node = cofactor
+        depth += 1
+    return text + "[%d,circle,draw]" % node.value + "]" * depth
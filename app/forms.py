@@ -1,51 +1,190 @@
+from collections import Counter
+from fractions import Fraction
+from math import lcm, prod
+
+from flask import current_app
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms import StringField, SubmitField, SelectField
+from werkzeug.datastructures import MultiDict
+from wtforms.validators import DataRequired, Optional, StopValidation, ValidationError
+
+from app import factor
+from app import metrics
+from app import parse
+
+RENDERERS = [('tex', 'LaTeX'), ('svg', 'SVG (no LaTeX)')]
+
+
+def default_renderer():
+    return current_app.config['DEFAULT_RENDERER']
+
+
+class ParsedField(StringField):
+    """
+    A text field read with one of the app.parse functions instead of sympify
+    The result is in .parsed once the form validates, and input the parser
+    refuses becomes the field's error.
+    """
+    parser = None
+
+    def __init__(self, label=None, validators=None, **kwargs):
+        super().__init__(label, validators, **kwargs)
+        self.parsed = None
+
+    def pre_validate(self, form):
+        if self.data:
+            try:
+                with metrics.stage('parse'):
+                    self.parsed = self.parser(self.data)
+            except parse.ParseError as e:
+                raise StopValidation(str(e))
+
+
+class IntegerField(ParsedField):
+    parser = staticmethod(parse.parse_integer)
+
+
+class IntegerListField(ParsedField):
+    parser = staticmethod(parse.parse_integers)
+
+
+class NumberField(ParsedField):
+    parser = staticmethod(parse.parse_number)
+
+
+class PolynomialField(ParsedField):
+    parser = staticmethod(parse.parse_polynomial)
+
+
+class FunctionsField(ParsedField):
+    parser = staticmethod(parse.parse_functions)
 
 
 class PolynomialLongDiv(FlaskForm):
-    divisor = StringField('Divisor', validators=[DataRequired()])
-    dividend = StringField('Dividend', validators=[DataRequired()])
+    divisor = PolynomialField('Divisor', validators=[DataRequired()])
+    dividend = PolynomialField('Dividend', validators=[DataRequired()])
     submit = SubmitField('Get LaTeX')
 
+    def validate_divisor(self, field):
+        if field.parsed == 0:
+            raise ValidationError('must not be zero')
+
 
 class IntegerLongDiv(FlaskForm):
-    divisor = StringField('Divisor', validators=[DataRequired()])
-    dividend = StringField('Dividend', validators=[DataRequired()])
+    divisor = IntegerField('Divisor', validators=[DataRequired()])
+    dividend = IntegerField('Dividend', validators=[DataRequired()])
     submit = SubmitField('Get LaTeX')
 
+    def validate_divisor(self, field):
+        if field.parsed < 1:
+            raise ValidationError('must be a whole number greater than 0')
+
+    def validate_dividend(self, field):
+        if field.parsed < 0:
+            raise ValidationError('must not be negative')
+
 
 class SyntheticDivision(FlaskForm):
-    divisor = StringField('Divisor', validators=[DataRequired()])
-    dividend = StringField('Dividend', validators=[DataRequired()])
+    divisor = PolynomialField('Divisor', validators=[DataRequired()])
+    dividend = PolynomialField('Dividend', validators=[DataRequired()])
     submit = SubmitField('Get LaTeX')
 
+    def validate_divisor(self, field):
+        if len(parse.parse_coefficients(field.data)) != 2:
+            raise ValidationError('must be of the form x - c or ax - b')
+
+
+class RationalRoots(FlaskForm):
+    polynomial = PolynomialField('Polynomial', validators=[DataRequired()])
+    submit = SubmitField('Get LaTeX')
+
+    def validate_polynomial(self, field):
+        coeffs = parse.parse_coefficients(field.data)
+        if len(coeffs) < 2:
+            raise ValidationError('must have a term in x')
+        # Candidates are p/q for p dividing the lowest nonzero coefficient and q the leading one, cleared of fractions
+        scale = lcm(*(Fraction(c).denominator for c in coeffs))
+        ends = [int(c * scale) for c in (next(c for c in coeffs if c != 0), coeffs[-1])]
+        try:
+            candidates = 2 * prod(prod(e + 1 for e in Counter(factor.prime_factors(abs(n))).values()) for n in ends)
+        except factor.FactorError:
+            raise ValidationError('has coefficients too big to factor')
+        if candidates > current_app.config['RATIONAL_ROOTS_MAX_CANDIDATES']:
+            raise ValidationError('has up to %d possible rational roots, at most %d can be tried'
+                                  % (candidates, current_app.config['RATIONAL_ROOTS_MAX_CANDIDATES']))
+
 
 class VerticalAddition(FlaskForm):
-    addends = StringField('Addends', validators=[DataRequired()])
+    addends = IntegerListField('Addends', validators=[DataRequired()])
     submit = SubmitField('Get LaTeX')
 
+    def validate_addends(self, field):
+        if any(n < 0 for n in field.parsed):
+            raise ValidationError('must not be negative')
+
 
 class VerticalSubtraction(FlaskForm):
-    subtrahends = StringField('Subtrahends', validators=[DataRequired()])
+    subtrahends = IntegerListField('Subtrahends', validators=[DataRequired()])
     submit = SubmitField('Get LaTeX')
 
+    def validate_subtrahends(self, field):
+        if len(field.parsed) != 2:
+            raise ValidationError('enter two numbers, a, b for a - b')
+        a, b = field.parsed
+        if b < 0 or a < b:
+            raise ValidationError('need a >= b >= 0 for a - b')
+
 
 class GraphPlotter(FlaskForm):
-    function = StringField('Function(s)', validators=[DataRequired()])
+    function = FunctionsField('Function(s)', validators=[DataRequired()])
+    renderer = SelectField('Renderer', choices=RENDERERS, default=default_renderer)
     submit = SubmitField('Get Image')
 
 
 class FactorTree(FlaskForm):
-    function = StringField('Number', validators=[DataRequired()])
+    function = IntegerField('Number', validators=[DataRequired()])
+    renderer = SelectField('Renderer', choices=RENDERERS, default=default_renderer)
     submit = SubmitField('Get Image')
 
+    def validate_function(self, field):
+        if field.parsed < 1:
+            raise ValidationError('must be a whole number greater than 0')
+
 
 class NumberLine(FlaskForm):
-    first = StringField('Starting Point', validators=[DataRequired()])
-    last = StringField('Ending Point', validators=[DataRequired()])
-    a = StringField('Point', validators=[DataRequired()])
-    relation = StringField('Inequality Symbol', validators=[DataRequired()])
+    first = NumberField('Starting Point', validators=[DataRequired()])
+    last = NumberField('Ending Point', validators=[DataRequired()])
+    a = NumberField('Point', validators=[Optional()])
+    relation = StringField('Inequality Symbol, or an Inequality in x', validators=[DataRequired()])
+    renderer = SelectField('Renderer', choices=RENDERERS, default=default_renderer)
 
     submit = SubmitField('Get Image')
 
+    def validate_last(self, field):
+        if self.first.parsed is not None and field.parsed <= self.first.parsed:
+            raise ValidationError('must be more than the starting point')
+
+    def validate_relation(self, field):
+        """Either a symbol comparing x with the point, or a whole inequality like -2 < x <= 3 or x < -1 or x > 2"""
+        if field.data.strip() in ('<', '<=', '>', '>='):
+            if self.a.parsed is None:
+                raise ValidationError('needs a point to compare x with')
+            self.solution = parse.ray(self.a.parsed, field.data.strip())
+            return
+        try:
+            with metrics.stage('parse'):
+                self.solution = parse.parse_inequality(field.data)
+        except parse.ParseError as e:
+            raise ValidationError(str(e))
+
+
+def read_form(form_class, data):
+    """
+    The form filled in from a dict of field values and validated, check its errors
+    Numbers may be json numbers and lists json lists, everything else is the text typed in the form.
+    """
+    formdata = MultiDict({name: ', '.join(map(str, value)) if isinstance(value, list) else str(value)
+                          for name, value in data.items()})
+    form = form_class(formdata=formdata, meta={'csrf': False})
+    form.validate()
+    return form
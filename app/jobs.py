@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app
+from app import cost
+from app import metrics
+from app import render
+
+
+class QueueFull(Exception):
+    """Raised when as many render jobs are pending as the queue allows"""
+
+
+class RenderJobs(object):
+    """
+    Renders images in a process pool so requests don't wait on TeX
+    A job's id is the cache key of its image, so submitting a figure that is already
+    being rendered joins the job in flight instead of starting another, and once
+    the image is cached any worker can answer for the job.
+    At most `depth` jobs may be pending, beyond that submit raises QueueFull.
+    A failed job's future is let go as soon as it finishes, keeping only its error until it
+    has been reported once, for failure_ttl seconds, or until max_failures newer ones push it out.
+    """
+
+    def __init__(self, processes, depth, failure_ttl=600, max_failures=1024):
+        self.processes = processes
+        self.depth = depth
+        self.failure_ttl = failure_ttl
+        self.max_failures = max_failures
+        self.executor = None
+        self.jobs = {}
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # Started on first use, after any pre-forking, and spawned so the children don't inherit threads
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def submit(self, tool, *args, renderer='tex'):
+        """Starts rendering the tool's figure for args, returns the job id, raises cost.TooExpensive"""
+        args = cost.admit(tool, args)
+        if renderer == 'svg':
+            # Drawn in process in a few milliseconds, nothing to queue
+            with metrics.stage('svg'):
+                svg = render.SVG[tool](*args)
+            render.store_svg(tool, svg)
+            return render.svg_key(tool, svg)
+
+        with metrics.stage('tikz'):
+            body = render.TIKZ[tool](*args)
+        key = render.image_key(tool, body)
+        with self.lock:
+            if key in self.jobs or render.cached_url(key) is not None:
+                return key
+            if sum(not future.done() for future in self.jobs.values()) >= self.depth:
+                raise QueueFull(f'{self.depth} render jobs are already pending')
+            # Timed in the worker, and merged back in when the job finishes
+            future = self._executor().submit(metrics.run, render.render_images, tool, [body])
+            self.jobs[key] = future
+            self.failures.pop(key, None)
+        future.add_done_callback(lambda future: self._finished(key, future))
+        return key
+
+    def _finished(self, key, future):
+        # Successes are in the cache, failures leave their error for status to report
+        error = future.exception()
+        if error is None:
+            metrics.unpack(future.result())
+        else:
+            metrics.registry.merge(getattr(error, 'recorded', ({}, {})))
+        with self.lock:
+            if self.jobs.get(key) is future:
+                del self.jobs[key]
+                if error is not None:
+                    self.failures[key] = (time.monotonic(), str(error) or type(error).__name__)
+                    self._expire_failures()
+
+    def _expire_failures(self):
+        """Drops failures past failure_ttl or beyond max_failures, oldest first, with the lock held"""
+        now = time.monotonic()
+        while self.failures:
+            failed_at, _ = next(iter(self.failures.values()))
+            if len(self.failures) <= self.max_failures and now - failed_at <= self.failure_ttl:
+                break
+            self.failures.popitem(last=False)
+
+    def status(self, key):
+        """
+        Returns a dict describing job key, with 'status' one of
+        done (and the image's 'url'), pending, failed (and the 'error') or unknown
+        """
+        # Taken before looking in the store, so a job finishing in between is still found one way or the other
+        with self.lock:
+            self._expire_failures()
+            future = self.jobs.get(key)
+            failure = self.failures.pop(key, None)
+        url = render.cached_url(key)
+        if url is not None:
+            return {'status': 'done', 'url': url}
+
+        if failure is not None:
+            return {'status': 'failed', 'error': failure[1]}
+        if future is None:
+            # Possibly being rendered by another worker, which any of them can answer for once it's stored
+            return {'status': 'unknown'}
+        if not future.done():
+            return {'status': 'pending'}
+        error = future.exception()
+        if error is None:
+            urls, _ = future.result()
+            return {'status': 'done', 'url': urls[0]}
+        # Finished but not yet seen by _finished, which then finds the job gone and records nothing
+        with self.lock:
+            if self.jobs.get(key) is future:
+                del self.jobs[key]
+        return {'status': 'failed', 'error': str(error) or type(error).__name__}
+
+    def pending(self):
+        with self.lock:
+            return sum(not future.done() for future in self.jobs.values())
+
+
+jobs = RenderJobs(app.config['RENDER_PROCESSES'], app.config['RENDER_JOB_QUEUE_DEPTH'])
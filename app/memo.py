@@ -0,0 +1,174 @@
+"""
+Memoizes the text tools' LaTeX
+Arguments are canonicalized through sympy before they are hashed, so x**2 + 1 and
+1 + x**2, or 7 and Integer(7), share an entry, and the hash is salted with MEMO_VERSION,
+so a deploy never serves what the code before it wrote. Results are kept in a bounded LRU,
+and with MEMO_DIR set also written to disk where every worker process can find them,
+which a reaper thread trims back to MEMO_DIR_MAX_BYTES, least recently used first.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import sympy as sym
+
+from app import app
+
+# The modules whose code decides what the memoized tools return
+SOURCES = ('tools.py', 'polynomial.py', 'digits.py', 'factor.py', 'memo.py')
+
+# Reads of a result on disk more often than this many seconds apart only mark it as used once
+TOUCH_INTERVAL = 60
+
+
+def canonical(value):
+    """A string identifying value up to sympy's normal form"""
+    if isinstance(value, (list, tuple)):
+        return '(' + ', '.join(canonical(v) for v in value) + ')'
+    return sym.srepr(sym.sympify(value))
+
+
+def source_version():
+    """A hash of SOURCES, which changes with any change to the tools' output"""
+    h = hashlib.sha256()
+    for name in SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+class Memo(object):
+    """
+    Bounded LRU of function results keyed by a hash of the function and its canonical arguments
+    Counts hits (in memory or on disk) and misses, see stats. On disk a result's mtime is its
+    last use, and the directory is kept under max_bytes like the render store's.
+    """
+
+    def __init__(self, max_entries, directory=None, max_bytes=None, reap_interval=60, version=''):
+        self.max_entries = max_entries
+        self.version = version
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.reap_interval = reap_interval
+        self.reaper = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, name, args):
+        return hashlib.sha256((self.version + '\0' + name + canonical(args)).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.tex')
+
+    def get(self, key):
+        """The cached result for key or None"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    value = f.read()
+                if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+                    os.utime(path)
+            except FileNotFoundError:
+                pass
+            else:
+                self._remember(key, value)
+                with self.lock:
+                    self.disk_hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.directory:
+            # Renamed into place whole, so other workers never read half a result
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp, self._path(key))
+            if self.max_bytes is not None:
+                self.start_reaper()
+
+    def start_reaper(self):
+        # Threads don't survive a fork, so this also restarts the reaper in forked workers
+        with self.lock:
+            if self.reaper is None or not self.reaper.is_alive():
+                self.reaper = threading.Thread(target=self._reap_forever, name='memo_reaper', daemon=True)
+                self.reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            self.reap()
+            time.sleep(self.reap_interval)
+
+    def reap(self, stale_after=600):
+        """Removes temporary files abandoned for stale_after seconds, then least recently used results past max_bytes"""
+        now = time.time()
+        used, sizes = {}, {}
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith('.tmp') and now - stat.st_mtime > stale_after:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.tex'):
+                used[entry.path], sizes[entry.path] = stat.st_mtime, stat.st_size
+        total = sum(sizes.values())
+        for path in sorted(used, key=used.get):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= sizes[path]
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'max_entries': self.max_entries}
+
+    def memoize(self, function):
+        """Decorator caching a function of sympifiable arguments that returns a string"""
+        name = f'{function.__module__}.{function.__qualname__}'
+
+        @functools.wraps(function)
+        def memoized(*args, **kwargs):
+            try:
+                key = self.key(name, args + tuple(sorted(kwargs.items())))
+            except (sym.SympifyError, TypeError, ValueError):
+                return function(*args, **kwargs)
+            value = self.get(key)
+            if value is None:
+                value = function(*args, **kwargs)
+                self.put(key, value)
+            return value
+        return memoized
+
+
+results = Memo(app.config['MEMO_MAX_ENTRIES'], app.config['MEMO_DIR'], app.config['MEMO_DIR_MAX_BYTES'],
+               app.config['RENDER_REAP_INTERVAL'], app.config['MEMO_VERSION'] or source_version())
@@ -0,0 +1,222 @@
+"""
+Timing and counting for every stage of a request, exported in Prometheus text format
+Stages are timed with `with metrics.stage('parse'):` wherever the work happens, into
+a latency histogram per stage and an error counter when the block raises. Within a request
+the stage times are also kept for its log line. Work done in the render and api worker
+processes is timed there and merged back into the web process with the result, see run.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+# Name: (type, help) of everything exported
+METRICS = {
+    'sme_request_seconds': ('histogram', 'Time to answer a request, by endpoint, method and status'),
+    'sme_stage_seconds': ('histogram', 'Time spent in each stage of the work behind a request'),
+    'sme_stage_errors_total': ('counter', 'Stages that ended with an exception'),
+    'sme_subprocess_exits_total': ('counter', 'Exit codes of the TeX engines and svg converters, or timeout'),
+    'sme_memo_hits_total': ('counter', 'Text tool results found in the in-process memo'),
+    'sme_memo_disk_hits_total': ('counter', 'Text tool results found in MEMO_DIR'),
+    'sme_memo_misses_total': ('counter', 'Text tool results that had to be computed'),
+    'sme_renders_refused_total': ('counter', 'Figures refused by app.cost as too big to draw'),
+    'sme_render_jobs_pending': ('gauge', 'Render jobs submitted and not finished'),
+}
+
+
+class Registry(object):
+    """Counters and histograms keyed by metric name and a sorted tuple of label pairs"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, labels_key(labels))
+        with self.lock:
+            buckets, total = self.histograms.get(key, ([0] * (len(BUCKETS) + 1), 0))
+            buckets = list(buckets)
+            buckets[bisect_left(BUCKETS, seconds)] += 1
+            self.histograms[key] = (buckets, total + seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), dict(self.histograms)
+
+    def since(self, before):
+        """What was recorded after the snapshot before, in a form merge accepts"""
+        counters, histograms = self.snapshot()
+        counters = {key: value - before[0].get(key, 0) for key, value in counters.items()
+                    if value != before[0].get(key, 0)}
+        changed = {}
+        for key, (buckets, total) in histograms.items():
+            old_buckets, old_total = before[1].get(key, ([0] * len(buckets), 0))
+            if buckets != old_buckets:
+                changed[key] = ([a - b for a, b in zip(buckets, old_buckets)], total - old_total)
+        return counters, changed
+
+    def merge(self, recorded):
+        counters, histograms = recorded
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (buckets, total) in histograms.items():
+                old_buckets, old_total = self.histograms.get(key, ([0] * len(buckets), 0))
+                self.histograms[key] = ([a + b for a, b in zip(buckets, old_buckets)], total + old_total)
+
+    def exposition(self, gauges=()):
+        """Everything in Prometheus text format, with gauges given as (name, labels, value)"""
+        counters, histograms = self.snapshot()
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append('%s%s %s' % (name, label_text(labels), number(value)))
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append('%s%s %s' % (name, label_text(labels), number(value)))
+        for (name, labels), (buckets, total) in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, label_text(labels + (('le', str(bound)),)), cumulative))
+            lines.append('%s_sum%s %s' % (name, label_text(labels), number(total)))
+            lines.append('%s_count%s %d' % (name, label_text(labels), cumulative))
+
+        text = ''
+        for name in sorted(samples):
+            kind, description = METRICS[name]
+            text += '# HELP %s %s\n# TYPE %s %s\n' % (name, description, name, kind)
+            text += '\n'.join(sorted(samples[name]) if kind != 'histogram' else samples[name]) + '\n'
+        return text
+
+
+def labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join('%s="%s"' % (name, value) for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+@contextmanager
+def stage(name):
+    """Times the block as stage name, counting an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.inc('sme_stage_errors_total', stage=name)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe('sme_stage_seconds', seconds, stage=name)
+        if has_request_context():
+            stages = g.setdefault('stages', {})
+            stages[name] = stages.get(name, 0) + seconds
+
+
+def exited(command, code):
+    """Counts a subprocess exit code, or 'timeout'"""
+    registry.inc('sme_subprocess_exits_total', command=command, code=code)
+
+
+def run(function, *args):
+    """
+    Calls function in a worker process, returning its result and what it recorded
+    The caller merges the recording into its own registry with unpack. Worker processes
+    run one call at a time, so nothing else is recorded in between. An exception carries
+    its recording as .recorded.
+    """
+    before = registry.snapshot()
+    try:
+        return function(*args), registry.since(before)
+    except Exception as e:
+        e.recorded = registry.since(before)
+        raise
+
+
+def unpack(outcome):
+    """The result of a call through run, merging what it recorded into this process' registry"""
+    result, recorded = outcome
+    registry.merge(recorded)
+    return result
+
+
+# One profile at a time per process, cProfile can't run two at once, so concurrent sampled requests skip it
+profile_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Times every request, and depending on config logs each one as a json line (REQUEST_LOG)
+    and profiles a random PROFILE_SAMPLE_RATE of them into PROFILE_DIR
+    Timing, logging and the profile are finished in teardown_request, which runs for requests
+    that raised too; those are recorded with status 500.
+    """
+    log = logging.getLogger('app.requests')
+    if app.config['REQUEST_LOG']:
+        log.setLevel(logging.INFO)
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate:
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+
+    @app.before_request
+    def start():
+        g.start = time.perf_counter()
+        if rate and random.random() < rate and profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler, e.g. a debugger's, is already active in this process
+                profile_lock.release()
+                return
+            g.profile = profile
+
+    @app.after_request
+    def status(response):
+        g.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish(error):
+        seconds = time.perf_counter() - g.get('start', time.perf_counter())
+        endpoint = request.endpoint or 'none'
+        code = g.pop('status', 500 if error is not None else 200)
+        registry.observe('sme_request_seconds', seconds, endpoint=endpoint, method=request.method, status=code)
+
+        profile = g.pop('profile', None)
+        if profile is not None:
+            try:
+                profile.disable()
+                profile.dump_stats(os.path.join(app.config['PROFILE_DIR'], f'{time.time_ns()}-{endpoint}.prof'))
+            finally:
+                profile_lock.release()
+        if app.config['REQUEST_LOG']:
+            log.info(json.dumps({'method': request.method, 'path': request.path, 'endpoint': endpoint,
+                                 'status': code, 'ms': round(seconds * 1000, 3),
+                                 'stages': {name: round(t * 1000, 3) for name, t in g.get('stages', {}).items()}}))
@@ -0,0 +1,133 @@
+"""
+Minifies the SVGs pdf2svg and dvisvgm write, before they are stored
+Both converters write every coordinate to six decimals, every style declaration including the
+defaults, an id like glyph12-3 on every glyph, and pdf2svg a symbol per glyph per font subset,
+so the same digit can be defined several times over. minify rounds the numbers, compacts path
+data, drops default declarations, metadata and empty glyphs, defines each distinct glyph once
+and gives ids the shortest names free. It works on the text with regular expressions, which
+is enough for what the converters and app.svg produce, and never touches text content.
+"""
+import re
+
+# Decimals kept of every coordinate, a thousandth of a point is far below a pixel at any zoom
+DECIMALS = 3
+
+# Attributes holding numbers that can be rounded
+NUMERIC = {'d', 'points', 'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry', 'width', 'height',
+           'viewBox', 'transform', 'style', 'stroke-width', 'font-size'}
+# Style declarations that only restate the initial value
+DEFAULTS = {'fill-opacity:1', 'stroke-opacity:1', 'opacity:1', 'fill-rule:nonzero', 'clip-rule:nonzero',
+            'stroke-linecap:butt', 'stroke-linejoin:miter', 'stroke-dasharray:none', 'stroke-dashoffset:0'}
+
+NUMBER = re.compile(r'-?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?')
+ATTRIBUTE = re.compile(r'([\w:-]+)=(["\'])(.*?)\2', re.S)
+RGB = re.compile(r'rgb\(([\d.]+)%,\s*([\d.]+)%,\s*([\d.]+)%\)')
+SYMBOL = re.compile(r'<symbol\b[^>]*\bid=["\']([^"\']+)["\'][^>]*>(.*?)</symbol>', re.S)
+EMPTY_GLYPH = re.compile(r'\s*<path[^>]*\bd=(["\'])\s*\1[^>]*/>\s*')
+USE = re.compile(r'<use\b[^>]*\bhref=["\']#([^"\']+)["\'][^>]*/>')
+REFERENCE = re.compile(r'(\bid=["\']|#)([\w.:-]+)(?=["\')])')
+STRIP = [re.compile(pattern, re.S) for pattern in (r'<\?xml.*?\?>', r'<!--.*?-->', r'<title>.*?</title>',
+                                                    r'<desc>.*?</desc>', r'<metadata>.*?</metadata>',
+                                                    r'\sversion=["\'][\d.]+["\']')]
+
+
+def number(match):
+    """A number to DECIMALS places without the zeros that don't change it"""
+    text = ('%.*f' % (DECIMALS, float(match.group()))).rstrip('0').rstrip('.')
+    if text in ('-0', ''):
+        return '0'
+    return text.replace('0.', '.', 1) if text.startswith(('0.', '-0.')) else text
+
+
+def path_data(d):
+    """
+    Path data rounded, with only the separators a reader needs
+    A command repeating the one before it is left implied, as the path grammar allows for all
+    but moveto, whose repeats mean lineto.
+    """
+    d = NUMBER.sub(number, d)
+    # pdf2svg ends every subpath by moving back to its start, which draws nothing
+    d = re.sub(r'([Zz])\s*[Mm][^A-Za-df-z]*$', r'\1', d)
+    text, previous = '', None
+    for command, arguments in re.findall(r'([A-Za-df-z])([^A-Za-df-z]*)', d):
+        arguments = ' '.join(arguments.replace(',', ' ').split()).replace(' -', '-')
+        if command == previous and command not in 'Mm' and arguments:
+            text += arguments if arguments.startswith('-') else ' ' + arguments
+        else:
+            text += command + arguments
+        previous = command
+    return text
+
+
+def color(match):
+    rgb = ['%02x' % round(float(percent) * 2.55) for percent in match.groups()]
+    if all(pair[0] == pair[1] for pair in rgb):
+        rgb = [pair[0] for pair in rgb]
+    return '#' + ''.join(rgb)
+
+
+def style(value):
+    value = RGB.sub(color, NUMBER.sub(number, value))
+    declarations = [declaration.strip() for declaration in value.split(';')]
+    return ';'.join(declaration for declaration in declarations if declaration and declaration not in DEFAULTS)
+
+
+def attribute(match):
+    name, quote, value = match.groups()
+    if name == 'd':
+        value = path_data(value)
+    elif name == 'style':
+        value = style(value)
+        if not value:
+            return ''
+    elif name in NUMERIC:
+        value = NUMBER.sub(number, value)
+    elif name in ('fill', 'stroke'):
+        value = RGB.sub(color, value)
+    return f'{name}={quote}{value}{quote}'
+
+
+def short_names():
+    """a, b, ..., z, A, ..., Z, aa, ab, ..."""
+    letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    length = 1
+    while True:
+        for index in range(len(letters) ** length):
+            name = ''
+            for _ in range(length):
+                index, digit = divmod(index, len(letters))
+                name = letters[digit] + name
+            yield name
+        length += 1
+
+
+def glyphs(svg):
+    """Removes empty and duplicate symbols and the uses of empty ones, pointing duplicates at the first"""
+    first, empty = {}, set()
+    for match in SYMBOL.finditer(svg):
+        if not EMPTY_GLYPH.sub('', match.group(2)).strip():
+            empty.add(match.group(1))
+        first.setdefault(match.group(2), match.group(1))
+    same = {match.group(1): first[match.group(2)] for match in SYMBOL.finditer(svg)}
+
+    svg = SYMBOL.sub(lambda match: '' if match.group(1) in empty or same[match.group(1)] != match.group(1)
+                     else match.group(), svg)
+    svg = USE.sub(lambda match: '' if match.group(1) in empty else match.group(), svg)
+    return REFERENCE.sub(lambda match: match.group(1) + same.get(match.group(2), match.group(2))
+                         if match.group(1) == '#' else match.group(), svg)
+
+
+def minify(svg):
+    """The svg, as bytes, drawing the same picture in fewer bytes"""
+    svg = svg.decode('utf-8')
+    for pattern in STRIP:
+        svg = pattern.sub('', svg)
+    svg = re.sub(r'>\s+<', '><', svg).strip()
+    svg = ATTRIBUTE.sub(attribute, svg)
+    svg = re.sub(r'\s+(?=/?>)', '', svg)
+    svg = glyphs(svg)
+
+    ids = dict(zip(dict.fromkeys(match.group(2) for match in REFERENCE.finditer(svg) if match.group(1) != '#'),
+                   short_names()))
+    svg = REFERENCE.sub(lambda match: match.group(1) + ids.get(match.group(2), match.group(2)), svg)
+    return svg.encode('utf-8')
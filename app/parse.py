@@ -0,0 +1,438 @@
+# coding=utf-8
+"""
+Parses form input for the tools without sympify
+Accepts exactly what the tools take: integers, lists of integers, polynomials in x with
+rational coefficients, written with + - * / ** ^ and parentheses, and inequalities in x. Expressions are
+evaluated while they are parsed, checking every intermediate result against the size,
+degree and exponent limits in app.config before it is computed, so inputs like 9**9**9
+are refused in microseconds instead of tying up a worker.
+The plotter's functions of x are read by sympy's parser, but only once the text is known to hold
+nothing but numbers, x, operators and whitelisted function names, and without evaluating them;
+they are then evaluated a node at a time under the same limits.
+Sympy is only imported once a parsed value is turned into a sympy expression.
+"""
+import re
+import time
+from collections import namedtuple
+from fractions import Fraction
+from functools import lru_cache
+from math import log2
+
+from app import app
+
+Limits = namedtuple('Limits', ['length', 'depth', 'degree', 'digits', 'deadline'])
+
+limits = Limits(app.config['PARSE_MAX_LENGTH'], app.config['PARSE_MAX_DEPTH'], app.config['PARSE_MAX_DEGREE'],
+                app.config['PARSE_MAX_DIGITS'], app.config['PARSE_DEADLINE'])
+
+# A stretch of the number line, None for an end that goes on forever
+Interval = namedtuple('Interval', ['low', 'high', 'low_closed', 'high_closed'])
+
+TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|(x)|(\*\*|[-+*/^(),\[\]]))')
+FUNCTION_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-z]\w*)|(\*\*|[-+*/^(),]))')
+
+# Names the plotter's functions may use, as sympy names them unless mapped here
+FUNCTION_NAMES = ('x', 'sin', 'cos', 'tan', 'sec', 'csc', 'cot', 'asin', 'acos', 'atan', 'sinh', 'cosh', 'tanh',
+                  'asinh', 'acosh', 'atanh', 'exp', 'log', 'ln', 'sqrt', 'cbrt', 'abs', 'Abs', 'floor', 'ceiling',
+                  'sign', 'pi', 'E')
+ALIASES = {'ln': 'log', 'abs': 'Abs'}
+# Digits of the largest number the plotter's functions may take a root of, finding perfect powers is slow past it
+MAX_ROOT_DIGITS = 80
+
+
+class ParseError(ValueError):
+    """Raised with a message meant for the person who typed the input"""
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise ParseError("unexpected '%s' at position %d" % (text[position:].lstrip()[0], position + 1))
+        number, variable, operator = match.groups()
+        if number is not None:
+            tokens.append(Fraction(number))
+        else:
+            tokens.append('**' if operator == '^' else variable or operator)
+        position = match.end()
+    return tokens
+
+
+# Polynomials are tuples of int or Fraction coefficients, lowest degree first, without trailing zeros
+
+def polynomial(coeffs):
+    coeffs = list(coeffs)
+    while coeffs and coeffs[-1] == 0:
+        coeffs.pop()
+    return tuple(c.numerator if isinstance(c, Fraction) and c.denominator == 1 else c for c in coeffs)
+
+
+def constant(p):
+    """The value of p if it doesn't involve x, None otherwise"""
+    if len(p) > 1:
+        return None
+    return p[0] if p else 0
+
+
+class Parser(object):
+    """Recursive descent over the tokens, evaluating as it goes"""
+
+    def __init__(self, tokens, limits):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+        self.limits = limits
+        self.deadline = time.monotonic() + limits.deadline
+        self.max_bits = int(limits.digits * log2(10)) + 1
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, token=None):
+        found = self.peek()
+        if token is not None and found != token:
+            raise ParseError("expected '%s' %s" % (token, self.where()))
+        self.position += 1
+        return found
+
+    def where(self):
+        if self.position >= len(self.tokens):
+            return 'at the end'
+        return 'before token %d' % (self.position + 1)
+
+    def check(self, p):
+        if time.monotonic() > self.deadline:
+            raise ParseError('took too long to read')
+        if len(p) - 1 > self.limits.degree:
+            raise ParseError('degree is more than %d' % self.limits.degree)
+        for c in p:
+            if self.bits(c) > self.max_bits:
+                raise ParseError('numbers have more than %d digits' % self.limits.digits)
+        return p
+
+    @staticmethod
+    def bits(c):
+        c = Fraction(c)
+        return max(c.numerator.bit_length(), c.denominator.bit_length())
+
+    def expression(self):
+        self.depth += 1
+        if self.depth > self.limits.depth:
+            raise ParseError('nested more than %d deep' % self.limits.depth)
+        p = self.term()
+        while self.peek() in ('+', '-'):
+            sign = 1 if self.take() == '+' else -1
+            q = self.term()
+            width = max(len(p), len(q))
+            p = self.check(polynomial((p[k] if k < len(p) else 0) + sign * (q[k] if k < len(q) else 0)
+                                      for k in range(width)))
+        self.depth -= 1
+        return p
+
+    def term(self):
+        p = self.unary()
+        while self.peek() in ('*', '/'):
+            if self.take() == '*':
+                p = self.multiply(p, self.unary())
+            else:
+                c = constant(self.unary())
+                if c is None:
+                    raise ParseError('can only divide by numbers')
+                if c == 0:
+                    raise ParseError('division by zero')
+                p = self.check(polynomial(Fraction(a) / c for a in p))
+        return p
+
+    def multiply(self, p, q):
+        if not p or not q:
+            return ()
+        if len(p) + len(q) - 2 > self.limits.degree:
+            raise ParseError('degree is more than %d' % self.limits.degree)
+        if max(map(self.bits, p)) + max(map(self.bits, q)) > self.max_bits + 64:
+            raise ParseError('numbers have more than %d digits' % self.limits.digits)
+        product = [0] * (len(p) + len(q) - 1)
+        for i, a in enumerate(p):
+            for j, b in enumerate(q):
+                product[i + j] += a * b
+        return self.check(polynomial(product))
+
+    def unary(self):
+        if self.peek() in ('+', '-'):
+            sign = self.take()
+            self.depth += 1
+            if self.depth > self.limits.depth:
+                raise ParseError('nested more than %d deep' % self.limits.depth)
+            p = self.unary()
+            self.depth -= 1
+            return p if sign == '+' else polynomial(-a for a in p)
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() != '**':
+            return base
+        self.take()
+        # Right associative like Python, so 2**3**2 is 2**9
+        exponent = constant(self.unary())
+        if exponent is None or Fraction(exponent).denominator != 1:
+            raise ParseError('exponents must be whole numbers')
+        exponent = int(exponent)
+
+        c = constant(base)
+        if c is not None:
+            if exponent < 0:
+                if c == 0:
+                    raise ParseError('division by zero')
+                c, exponent = 1 / Fraction(c), -exponent
+            if exponent and self.bits(c) > 1 and (self.bits(c) - 1) * exponent > self.max_bits:
+                raise ParseError('numbers have more than %d digits' % self.limits.digits)
+            return self.check(polynomial([Fraction(c) ** exponent]))
+
+        if exponent < 0:
+            raise ParseError('x can only be raised to whole numbers 0 and up')
+        if (len(base) - 1) * exponent > self.limits.degree:
+            raise ParseError('degree is more than %d' % self.limits.degree)
+        result = (1,)
+        for _ in range(exponent):
+            result = self.multiply(result, base)
+        return result
+
+    def atom(self):
+        token = self.take()
+        if isinstance(token, Fraction):
+            return self.check(polynomial([token]))
+        if token == 'x':
+            return (0, 1)
+        if token == '(':
+            p = self.expression()
+            self.take(')')
+            return p
+        if token is None:
+            raise ParseError('unexpected end of input')
+        raise ParseError("unexpected '%s' %s" % (token, 'at the start' if self.position == 1 else
+                                                 'after token %d' % (self.position - 1)))
+
+
+def parse_all(text, limits=limits):
+    """The comma separated polynomials in text, which may be wrapped in brackets or parentheses"""
+    if len(text) > limits.length:
+        raise ParseError('longer than %d characters' % limits.length)
+    tokens = tokenize(text)
+    if not tokens:
+        raise ParseError('nothing to read')
+    if len(tokens) > 1 and (tokens[0], tokens[-1]) in (('[', ']'), ('(', ')')) and ',' in tokens:
+        tokens = tokens[1:-1]
+
+    parser = Parser(tokens, limits)
+    values = [parser.expression()]
+    while parser.peek() == ',':
+        parser.take()
+        values.append(parser.expression())
+    if parser.peek() is not None:
+        raise ParseError("unexpected '%s' %s" % (parser.peek(), parser.where()))
+    return values
+
+
+def parse_one(text):
+    values = parse_all(text)
+    if len(values) > 1:
+        raise ParseError('expected one value, not a list')
+    return values[0]
+
+
+def to_integer(p):
+    c = constant(p)
+    if c is None or Fraction(c).denominator != 1:
+        raise ParseError('must be a whole number')
+    return int(c)
+
+
+@lru_cache(maxsize=4096)
+def parse_integer(text):
+    return to_integer(parse_one(text))
+
+
+@lru_cache(maxsize=4096)
+def parse_integers(text):
+    """A tuple of the comma separated integers in text"""
+    return tuple(to_integer(p) for p in parse_all(text))
+
+
+@lru_cache(maxsize=4096)
+def parse_number(text):
+    """A rational number as a sympy Rational"""
+    import sympy as sym
+
+    c = constant(parse_one(text))
+    if c is None:
+        raise ParseError('must be a number')
+    c = Fraction(c)
+    return sym.Rational(c.numerator, c.denominator)
+
+
+@lru_cache(maxsize=4096)
+def parse_coefficients(text):
+    """The coefficients of a polynomial in x, lowest degree first"""
+    return parse_one(text)
+
+
+@lru_cache(maxsize=4096)
+def parse_polynomial(text):
+    """A polynomial in x as a sympy expression"""
+    import sympy as sym
+
+    x = sym.symbols('x')
+    return sum((sym.Rational(Fraction(c).numerator, Fraction(c).denominator) * x ** k
+                for k, c in enumerate(parse_coefficients(text)) if c != 0), sym.Integer(0))
+
+
+RELATION = re.compile(r'(<=|>=|<|>)')
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+# Most parts joined by 'or' in one inequality
+MAX_INTERVALS = 8
+
+
+def ray(a, relation):
+    """The solution of x relation a, as a tuple of one Interval"""
+    if relation in ('<', '<='):
+        return (Interval(None, a, False, relation == '<='),)
+    return (Interval(a, None, relation == '>=', False),)
+
+
+@lru_cache(maxsize=4096)
+def parse_inequality(text):
+    """
+    The solution of an inequality in x as a tuple of Intervals, e.g. x >= 3, 3 > x, -2 < x <= 3
+    or x < -1 or x >= 2. The numbers around x can be anything parse_number reads.
+    """
+    if len(text) > limits.length:
+        raise ParseError('longer than %d characters' % limits.length)
+    parts = re.split(r'\bor\b', text)
+    if len(parts) > MAX_INTERVALS:
+        raise ParseError("has more than %d parts joined by 'or'" % MAX_INTERVALS)
+
+    intervals = []
+    for part in parts:
+        pieces = RELATION.split(part)
+        sides, relations = [side.strip() for side in pieces[::2]], pieces[1::2]
+        if len(sides) not in (2, 3) or sides.count('x') != 1 or (len(sides) == 3 and sides[1] != 'x'):
+            raise ParseError("expected an inequality in x like x < 3 or -2 < x <= 3, not '%s'" % part.strip())
+        numbers = [parse_number(side) for side in sides if side != 'x']
+        if len(sides) == 2:
+            intervals += ray(numbers[0], relations[0] if sides[0] == 'x' else FLIPPED[relations[0]])
+            continue
+        if all(relation in ('<', '<=') for relation in relations):
+            interval = Interval(numbers[0], numbers[1], relations[0] == '<=', relations[1] == '<=')
+        elif all(relation in ('>', '>=') for relation in relations):
+            interval = Interval(numbers[1], numbers[0], relations[1] == '>=', relations[0] == '>=')
+        else:
+            raise ParseError("both sides of '%s' must compare the same way" % part.strip())
+        if interval.low > interval.high or (interval.low == interval.high and not
+                                            (interval.low_closed and interval.high_closed)):
+            raise ParseError("no number satisfies '%s'" % part.strip())
+        intervals.append(interval)
+    return tuple(intervals)
+
+
+@lru_cache(maxsize=1)
+def function_names():
+    """What each of FUNCTION_NAMES stands for, and the constructors sympy's parser writes calls to"""
+    import sympy as sym
+
+    names = {name: getattr(sym, ALIASES.get(name, name)) for name in FUNCTION_NAMES if name != 'x'}
+    names['x'] = sym.Symbol('x')
+    # No builtins, so the parsed code can't reach anything but these
+    constructors = {name: getattr(sym, name) for name in ('Integer', 'Float', 'Rational', 'Add', 'Mul', 'Pow')}
+    return names, dict(constructors, __builtins__={})
+
+
+def check_function_tokens(text, limits):
+    """Refuses anything but numbers, operators and FUNCTION_NAMES, and nesting deeper than the limit"""
+    position, depth, signs, previous = 0, 0, 0, None
+    text = text.rstrip()
+    while position < len(text):
+        match = FUNCTION_TOKEN.match(text, position)
+        if match is None:
+            raise ParseError("unexpected '%s' at position %d" % (text[position:].lstrip()[0], position + 1))
+        number, name, operator = match.groups()
+        if name is not None and name not in FUNCTION_NAMES:
+            raise ParseError("unknown name '%s' at position %d" % (name, match.start(2) + 1))
+        # Signs in a row nest like parentheses do
+        signs = signs + 1 if operator in ('+', '-') and previous in (None, '(', ',', '+', '-', '*', '/', '**', '^') \
+            else 0
+        depth += operator == '('
+        if depth + signs > limits.depth:
+            raise ParseError('nested more than %d deep' % limits.depth)
+        depth -= operator == ')'
+        previous = operator
+        position = match.end()
+    if position == 0:
+        raise ParseError('nothing to read')
+
+
+def evaluate_bounded(expr, parser):
+    """
+    expr, parsed without evaluating, evaluated from the leaves up
+    Every number is held to the digit limit before it is used, and a power to the digit limit
+    if its base is a number and to the degree limit if not, before it is computed.
+    """
+    if time.monotonic() > parser.deadline:
+        raise ParseError('took too long to read')
+    if expr.is_Rational and max(parser.bits(expr.p), parser.bits(expr.q)) > parser.max_bits:
+        raise ParseError('numbers have more than %d digits' % parser.limits.digits)
+    if not expr.args:
+        return expr
+    args = [evaluate_bounded(arg, parser) for arg in expr.args]
+    if expr.is_Pow and args[1].is_Rational:
+        base, exponent = args[0], abs(args[1].p)
+        if base.is_Rational:
+            bits = max(parser.bits(base.p), parser.bits(base.q))
+            if bits > 1 and (bits - 1) * exponent > parser.max_bits:
+                raise ParseError('numbers have more than %d digits' % parser.limits.digits)
+            if args[1].q != 1 and bits > MAX_ROOT_DIGITS * log2(10):
+                raise ParseError('can only take roots of numbers up to %d digits' % MAX_ROOT_DIGITS)
+        elif not base.is_Number and exponent > parser.limits.degree:
+            raise ParseError('exponents are more than %d' % parser.limits.degree)
+    try:
+        result = expr.func(*args)
+    except (TypeError, ValueError) as e:
+        raise ParseError(str(e))
+    if result.is_Rational and max(parser.bits(result.p), parser.bits(result.q)) > parser.max_bits:
+        raise ParseError('numbers have more than %d digits' % parser.limits.digits)
+    return result
+
+
+@lru_cache(maxsize=4096)
+def parse_functions(text, limits=limits):
+    """
+    One function of x for the plotter, or several separated by commas as a sympy Tuple,
+    e.g. x**2/4 - 1, sin(2*x), with the functions in FUNCTION_NAMES, pi and E
+    """
+    import sympy as sym
+    from sympy.parsing.sympy_parser import auto_number, convert_xor, parse_expr
+    from tokenize import TokenError
+
+    if len(text) > limits.length:
+        raise ParseError('longer than %d characters' % limits.length)
+    check_function_tokens(text, limits)
+    names, constructors = function_names()
+    try:
+        parsed = parse_expr(text, local_dict=dict(names), global_dict=dict(constructors),
+                            transformations=(auto_number, convert_xor), evaluate=False)
+    except (SyntaxError, TokenError):
+        raise ParseError('is not a complete expression')
+    except (TypeError, ValueError) as e:
+        raise ParseError(str(e))
+
+    parser = Parser([], limits)
+    values = list(parsed) if isinstance(parsed, tuple) else [parsed]
+    if not values or not all(isinstance(value, sym.Expr) for value in values):
+        raise ParseError('expected functions of x separated by commas')
+    try:
+        values = [evaluate_bounded(value, parser) for value in values]
+    except RecursionError:
+        raise ParseError('nested too deep')
+    return sym.Tuple(*values) if isinstance(parsed, tuple) else values[0]
@@ -0,0 +1,230 @@
+# coding=utf-8
+"""
+Samples sympy functions with NumPy for the graph plotter
+Points are refined adaptively where the curve bends or jumps, and the curve is cut
+at discontinuities and wherever it leaves the window, so neither pgfplots nor the
+browser has any math left to do.
+"""
+import numpy as np
+import sympy as sym
+
+from app.svg import svg_document, svg_line, svg_text, FONT, PT_PER_CM, THIN, THICK, ULTRA_THICK
+
+x = sym.symbols('x')
+
+# The plotter template's standard axis is the square -8..8 at .6cm per unit
+WINDOW = (-8, 8, -8, 8)
+UNIT = .6 * PT_PER_CM
+
+# pgfplots colors for each function in turn, with their svg equivalents
+COLORS = [('blue', 'rgb(0%,14.1%,41.2%)'), ('red', 'rgb(100%,0%,0%)'),
+          ('green!50!black', 'rgb(0%,50%,0%)'), ('orange', 'rgb(100%,50%,0%)'),
+          ('violet', 'rgb(50%,0%,50%)')]
+
+
+def as_functions(f):
+    """The plotter accepts one expression or several, e.g. sympify("x**2, sin(x)")"""
+    if isinstance(f, (tuple, list, sym.Tuple)):
+        return list(f)
+    return [f]
+
+
+def evaluate(func, xs):
+    """Evaluates a lambdified function at xs, anything undefined or complex comes back as nan"""
+    with np.errstate(all='ignore'):
+        try:
+            ys = np.asarray(func(xs), dtype=complex)
+        except (TypeError, ValueError, ZeroDivisionError, OverflowError):
+            ys = np.array([complex(func(float(value))) for value in xs])
+    ys = np.broadcast_to(ys, xs.shape)
+    real = ys.real.copy()
+    real[(np.abs(ys.imag) > 1e-9) | ~np.isfinite(real)] = np.nan
+    return real
+
+
+def sample(f, left, right, bottom, top, samples=64, depth=10, max_points=4000):
+    """
+    Samples f on [left, right], returns a list of (xs, ys) runs to be drawn as separate lines
+    Every round bisects the segments whose midpoint strays from the straight line by more than
+    a 500th of the window height, skipping those entirely above or below the window.
+    Segments that never settle are taken as discontinuities and split the curve if they jump
+    more than the window height, or if bisecting them finds a jump that doesn't shrink,
+    see jumps. Undefined points split it too.
+    """
+    func = sym.lambdify(x, f, 'numpy')
+    tolerance = (top - bottom) / 500
+
+    xs = np.linspace(left, right, samples)
+    ys = evaluate(func, xs)
+    active = np.ones(len(xs) - 1, dtype=bool)
+    for _ in range(depth):
+        index = np.flatnonzero(active)
+        if len(index) == 0 or len(xs) + len(index) > max_points:
+            break
+        xm = (xs[index] + xs[index + 1]) / 2
+        ym = evaluate(func, xm)
+        y0, y1 = ys[index], ys[index + 1]
+
+        with np.errstate(invalid='ignore'):
+            bent = np.abs(ym - (y0 + y1) / 2) > tolerance
+            undefined = np.isnan(y0) | np.isnan(y1) | np.isnan(ym)
+            partly_undefined = undefined & ~(np.isnan(y0) & np.isnan(y1) & np.isnan(ym))
+            hidden = ((y0 > top) & (y1 > top) & (ym > top)) | ((y0 < bottom) & (y1 < bottom) & (ym < bottom))
+        split = ((bent & ~undefined) | partly_undefined) & ~hidden
+
+        chosen = index[split]
+        xs = np.insert(xs, chosen + 1, xm[split])
+        ys = np.insert(ys, chosen + 1, ym[split])
+        # Each split segment becomes the two segments either side of its new midpoint
+        active = np.zeros(len(xs) - 1, dtype=bool)
+        shifted = chosen + np.arange(len(chosen))
+        active[shifted] = True
+        active[shifted + 1] = True
+
+    with np.errstate(invalid='ignore'):
+        steps = active & (np.abs(np.diff(ys)) > top - bottom)
+    unsettled = np.flatnonzero(active & ~steps)
+    steps[unsettled] = jumps(func, xs[unsettled], xs[unsettled + 1], ys[unsettled], ys[unsettled + 1], tolerance)
+    breaks = np.isnan(ys[:-1]) | np.isnan(ys[1:]) | steps
+
+    runs = []
+    start = 0
+    for end in list(np.flatnonzero(breaks)) + [len(xs) - 1]:
+        run_x, run_y = xs[start:end + 1], ys[start:end + 1]
+        keep = ~np.isnan(run_y)
+        if keep.sum() > 1:
+            runs.extend(clip(run_x[keep], run_y[keep], bottom, top))
+        start = end + 1
+    return runs
+
+
+def jumps(func, x0, x1, y0, y1, tolerance, rounds=8):
+    """
+    Which of the segments x0..x1 hold a jump rather than a steep stretch of curve
+    Each is bisected rounds times, keeping the half that changes most. Across a continuous
+    stretch that change shrinks with the interval, across a jump it stays the size of the jump.
+    """
+    change = np.abs(y1 - y0)
+    with np.errstate(invalid='ignore'):
+        candidates = change > tolerance
+    a, b, ya, yb = x0[candidates], x1[candidates], y0[candidates], y1[candidates]
+    for _ in range(rounds):
+        if len(a) == 0:
+            break
+        m = (a + b) / 2
+        ym = evaluate(func, m)
+        with np.errstate(invalid='ignore'):
+            left = np.abs(ym - ya) >= np.abs(yb - ym)
+        a, ya = np.where(left, a, m), np.where(left, ya, ym)
+        b, yb = np.where(left, m, b), np.where(left, ym, yb)
+    found = np.zeros(len(x0), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        # Undefined midpoints count as jumps too
+        found[candidates] = ~(np.abs(yb - ya) < change[candidates] / 2)
+    return found
+
+
+def clip(xs, ys, bottom, top, margin=.5):
+    """
+    Splits a run into the pieces inside bottom - margin .. top + margin
+    Pieces end on the boundary, interpolated from the first point outside, so
+    coordinates stay small enough for TeX and arrow tips land just out of view.
+    """
+    low, high = bottom - margin, top + margin
+    inside = (ys >= low) & (ys <= high)
+    pieces = []
+    index = np.flatnonzero(inside)
+    if len(index) == 0:
+        return pieces
+
+    # Consecutive runs of inside points
+    starts = index[np.r_[True, np.diff(index) > 1]]
+    ends = index[np.r_[np.diff(index) > 1, True]]
+    for start, end in zip(starts, ends):
+        px, py = list(xs[start:end + 1]), list(ys[start:end + 1])
+        if start > 0:
+            bound = high if ys[start - 1] > high else low
+            t = (bound - ys[start]) / (ys[start - 1] - ys[start])
+            px.insert(0, xs[start] + t * (xs[start - 1] - xs[start]))
+            py.insert(0, bound)
+        if end < len(xs) - 1:
+            bound = high if ys[end + 1] > high else low
+            t = (bound - ys[end]) / (ys[end + 1] - ys[end])
+            px.append(xs[end] + t * (xs[end + 1] - xs[end]))
+            py.append(bound)
+        if len(px) > 1:
+            pieces.append((np.array(px), np.array(py)))
+    return pieces
+
+
+def pgfplots_plots(f, left=-8, right=8):
+    """\\addplot commands for every function in f with precomputed coordinates"""
+    bottom, top = WINDOW[2], WINDOW[3]
+    plots = ""
+    for k, function in enumerate(as_functions(f)):
+        color = COLORS[k % len(COLORS)][0]
+        for xs, ys in sample(function, left, right, bottom, top):
+            coordinates = " ".join("(%.4f,%.4f)" % point for point in zip(xs, ys))
+            plots += "\\addplot[<->,ultra thick, color=%s] coordinates {%s};" % (color, coordinates)
+    return plots
+
+
+def svg_graph(f, left=-8, right=8):
+    """
+    SVG for f on the plotter template's standard axis
+    Grid, middle axes with arrows, ticks and labels every unit from -8 to 8, and each
+    function as an ultra thick polyline clipped to the window.
+    """
+    xmin, xmax, ymin, ymax = WINDOW
+    overhang = 15
+    font_size = 10
+
+    def px(value):
+        return value * UNIT
+
+    def py(value):
+        return -value * UNIT
+
+    elements = []
+    for i in range(xmin, xmax + 1):
+        elements.append(svg_line(px(i), py(ymin), px(i), py(ymax), THIN, 'rgb(75%,75%,75%)'))
+    for j in range(ymin, ymax + 1):
+        elements.append(svg_line(px(xmin), py(j), px(xmax), py(j), THIN, 'rgb(75%,75%,75%)'))
+
+    # Axes reach 15pt past the window and end in triangle tips both ways
+    for x1, y1, x2, y2 in [(px(xmin) - overhang, 0, px(xmax) + overhang, 0),
+                           (0, py(ymin) + overhang, 0, py(ymax) - overhang)]:
+        elements.append(svg_line(x1, y1, x2, y2, THICK))
+    tip = 4
+    for (tx, ty), (dx, dy) in [((px(xmax) + overhang, 0), (1, 0)), ((px(xmin) - overhang, 0), (-1, 0)),
+                               ((0, py(ymax) - overhang), (0, -1)), ((0, py(ymin) + overhang), (0, 1))]:
+        elements.append(f'<path d="M {tx + dx * tip:.2f} {ty + dy * tip:.2f} '
+                        f'L {tx - dy * tip:.2f} {ty + dx * tip:.2f} L {tx + dy * tip:.2f} {ty - dx * tip:.2f} Z" '
+                        f'fill="black"/>')
+
+    baseline = 2 + .644 * font_size + 3.333
+    for i in range(xmin, xmax + 1):
+        if i != 0:
+            elements.append(svg_line(px(i), -2.13, px(i), 2.13, THICK))
+            elements.append(svg_text(f'−{abs(i)}' if i < 0 else str(i), px(i), baseline, font_size))
+    for j in range(ymin, ymax + 1):
+        if j != 0:
+            elements.append(svg_line(-2.13, py(j), 2.13, py(j), THICK))
+            elements.append(f'<text x="-3.00" y="{py(j) + .322 * font_size:.2f}" font-size="{font_size}" '
+                            f'{FONT} text-anchor="end">{"−" if j < 0 else ""}{abs(j)}</text>')
+    elements.append(f'<text x="-3.00" y="{baseline:.2f}" font-size="{font_size}" {FONT} text-anchor="end">0</text>')
+    elements.append(f'<text x="{px(xmax) + 2 * overhang:.2f}" y="{.322 * 12:.2f}" font-size="12" {FONT} '
+                    f'font-style="italic">x</text>')
+    elements.append(svg_text('<tspan font-style="italic">y</tspan>', 0, py(ymax) - 2 * overhang, 12))
+
+    elements.append(f'<clipPath id="window"><rect x="{px(xmin):.2f}" y="{py(ymax):.2f}" '
+                    f'width="{px(xmax - xmin):.2f}" height="{px(ymax - ymin):.2f}"/></clipPath>')
+    for k, function in enumerate(as_functions(f)):
+        color = COLORS[k % len(COLORS)][1]
+        for xs, ys in sample(function, left, right, ymin, ymax):
+            points = " ".join("%.2f,%.2f" % (px(a), py(b)) for a, b in zip(xs, ys))
+            elements.append(f'<polyline points="{points}" fill="none" stroke="{color}" '
+                            f'stroke-width="{ULTRA_THICK}" stroke-linejoin="round" clip-path="url(#window)"/>')
+
+    return svg_document(elements, px(xmin) - overhang - tip - 8, py(ymax) - 2 * overhang - 12,
+                        px(xmax) + 2 * overhang + 8, py(ymin) + baseline + 2)
@@ -0,0 +1,288 @@
+# coding=utf-8
+"""
+Dense univariate polynomials for the division tools
+Coefficients are kept highest degree first as plain ints and fractions.Fraction
+whenever they are rational, which is nearly always, so the division steps are
+Python arithmetic rather than sympy. Anything symbolic stays a sympy expression.
+Synthetic division by many candidate roots at once is in horner_batch, see there.
+"""
+from fractions import Fraction
+from functools import lru_cache
+from math import gcd, lcm
+
+import numpy as np
+import sympy as sym
+
+from app import factor
+
+# Integer Horner columns that stay below this in absolute value can be done in int64
+INT64_SAFE = 1 << 62
+
+
+def to_number(c):
+    """A sympy coefficient as an int or Fraction if it is rational, unchanged otherwise"""
+    if isinstance(c, (int, Fraction)):
+        return c
+    c = sym.sympify(c)
+    if c.is_Integer:
+        return int(c)
+    if c.is_Rational:
+        return Fraction(int(c.p), int(c.q))
+    return c
+
+
+def whole(c):
+    """c as an int if it is a whole Fraction"""
+    return c.numerator if isinstance(c, Fraction) and c.denominator == 1 else c
+
+
+def is_number(c):
+    return isinstance(c, (int, Fraction))
+
+
+def to_sympy(c):
+    if isinstance(c, Fraction):
+        return sym.Rational(c.numerator, c.denominator)
+    return sym.sympify(c)
+
+
+class DensePoly(object):
+    """
+    A polynomial in x as its list of coefficients, highest degree first
+    Leading zeros are dropped, the zero polynomial is [0].
+    """
+    __slots__ = ('coeffs', 'x')
+
+    def __init__(self, coeffs, x=sym.symbols('x')):
+        coeffs = list(coeffs)
+        start = 0
+        while start < len(coeffs) - 1 and coeffs[start] == 0:
+            start += 1
+        self.coeffs = coeffs[start:] or [0]
+        self.x = x
+
+    @classmethod
+    def from_expr(cls, p, x=sym.symbols('x')):
+        if isinstance(p, cls):
+            return p
+        if not isinstance(p, sym.Poly):
+            p = sym.Poly(p, x)
+        return cls([to_number(c) for c in p.all_coeffs()], x)
+
+    @property
+    def degree(self):
+        return len(self.coeffs) - 1
+
+    @property
+    def lead(self):
+        return self.coeffs[0]
+
+    def is_zero(self):
+        return len(self.coeffs) == 1 and self.coeffs[0] == 0
+
+    def is_rational(self):
+        return all(is_number(c) for c in self.coeffs)
+
+    def all_terms(self):
+        """(degree, coefficient) for every power from the leading one down to the constant"""
+        return list(zip(range(self.degree, -1, -1), self.coeffs))
+
+    def terms(self):
+        """Like all_terms without the zeros, though the zero polynomial keeps its constant"""
+        terms = [(k, c) for k, c in self.all_terms() if c != 0]
+        return terms or [(0, 0)]
+
+    def shifted(self, c, k):
+        """c * x**k * self"""
+        return DensePoly([c * a for a in self.coeffs] + [0] * k, self.x)
+
+    def __sub__(self, other):
+        width = max(len(self.coeffs), len(other.coeffs))
+        a = [0] * (width - len(self.coeffs)) + self.coeffs
+        b = [0] * (width - len(other.coeffs)) + other.coeffs
+        return DensePoly([p - q for p, q in zip(a, b)], self.x)
+
+    def divmod(self, d):
+        """Quotient and remainder of self / d"""
+        q, steps = long_division(self, d)
+        return q, steps[-1][1] if steps else self
+
+    def as_expr(self):
+        return sum((to_sympy(c) * self.x ** k for k, c in self.all_terms()), sym.Integer(0))
+
+
+def divide(a, b):
+    """a / b, exact, and an int whenever b divides a"""
+    if isinstance(a, int) and isinstance(b, int) and b != 0 and a % b == 0:
+        return a // b
+    if is_number(a) and is_number(b):
+        c = Fraction(a, b)
+        return c.numerator if c.denominator == 1 else c
+    return to_sympy(a) / to_sympy(b)
+
+
+def long_division(n, d):
+    """
+    Divides n by d once, keeping every step for the long division layout
+    Returns the quotient and a list of (subtrahend, remainder) pairs, one per step,
+    where subtrahend is the multiple of d taken away from the previous remainder.
+    Rational coefficients are worked on in place as ints, or Fractions only where a
+    leading coefficient doesn't divide evenly; symbolic ones go through sympy.
+    """
+    if not (n.is_rational() and d.is_rational()):
+        return _long_division_sympy(n, d)
+
+    work = list(n.coeffs)
+    q = [0] * max(n.degree - d.degree + 1, 1)
+    steps = []
+    for i in range(n.degree - d.degree + 1):
+        if work[i] == 0:
+            continue
+        t = divide(work[i], d.lead)
+        work[i] = 0
+        for j in range(1, len(d.coeffs)):
+            work[i + j] -= t * d.coeffs[j]
+        k = n.degree - d.degree - i
+        q[len(q) - 1 - k] = t
+        steps.append((d.shifted(t, k), DensePoly(work[i + 1:], n.x)))
+    return DensePoly(q, n.x), steps
+
+
+def _long_division_sympy(n, d):
+    x = n.x
+    n, d = sym.Poly(n.as_expr(), x), sym.Poly(d.as_expr(), x)
+    q = 0
+    r = n
+    steps = []
+    while r != 0 and sym.degree(r) >= sym.degree(d):
+        t = sym.LT(r) / sym.LT(d)
+        q = q + t
+        r = r - t * d
+        steps.append((DensePoly.from_expr(t * d, x), DensePoly.from_expr(r, x)))
+    return DensePoly.from_expr(sym.Poly(q, x), x), steps
+
+
+def horner(coeffs, r):
+    """
+    The bottom row of the synthetic division of coeffs (highest degree first) by x - r
+    That is the quotient's coefficients followed by the remainder, which is the value at r.
+    """
+    row = [coeffs[0]]
+    for c in coeffs[1:]:
+        row.append(c + r * row[-1])
+    return [whole(b) for b in row]
+
+
+def horner_batch(coeffs, roots, rows=True):
+    """
+    Synthetic division of one polynomial by x - r for every r in roots in a single pass
+    Returns the bottom row for each root, as horner does, and the roots whose remainder is 0.
+    rows=False skips building the rows, giving None instead, when only the roots are wanted.
+    With integer coefficients all roots go through NumPy together, a column per Horner step.
+    A root p/q is worked on as the integers q**k * b_k, so rational roots vectorize just like
+    integers: in int64 when a bound on the columns fits, in arrays of Python ints otherwise.
+    Symbolic coefficients or roots are done one root at a time by horner.
+    """
+    roots = [whole(to_number(r)) for r in roots]
+    if not roots:
+        return [] if rows else None, []
+    ratios = [(r, 1) if isinstance(r, int) else (r.numerator, r.denominator) if isinstance(r, Fraction) else None
+              for r in roots]
+    if None in ratios or not all(isinstance(c, int) for c in coeffs):
+        table = [horner(coeffs, r) for r in roots]
+        return table if rows else None, [r for r, row in zip(roots, table) if row[-1] == 0]
+
+    # Python ints in object arrays when int64 could overflow, still one NumPy operation per column
+    bound = sum(map(abs, coeffs)) * max(max(abs(p), q) for p, q in ratios) ** (len(coeffs) - 1)
+    dtype = np.int64 if bound < INT64_SAFE else object
+    p = np.array([p for p, _ in ratios], dtype=dtype)
+    q = np.array([q for _, q in ratios], dtype=dtype)
+    scale = np.ones_like(q)
+    column = np.full_like(p, coeffs[0])
+    columns, scales = [column], [scale]
+    for c in coeffs[1:]:
+        scale = scale * q
+        column = column * p + c * scale
+        columns.append(column)
+        scales.append(scale)
+    survivors = [r for r, zero in zip(roots, (columns[-1] == 0).tolist()) if zero]
+    if not rows:
+        return None, survivors
+
+    # Back from q**k * b_k to b_k, exactly
+    columns = np.stack(columns, axis=1).tolist()
+    if all(q == 1 for _, q in ratios):
+        return columns, survivors
+    scales = np.stack(scales, axis=1).tolist()
+    return [[divide(b, s) for b, s in zip(row, row_scales)] for row, row_scales in zip(columns, scales)], survivors
+
+
+def integer_coefficients(coeffs):
+    """Rational coefficients scaled by the lcm of their denominators, so they are ints with the same roots"""
+    scale = lcm(*(Fraction(c).denominator for c in coeffs))
+    return [int(c * scale) for c in coeffs]
+
+
+def divisors(n):
+    """The positive divisors of n != 0, factoring with app.factor"""
+    found = [1]
+    primes = factor.prime_factors(abs(n))
+    for p in sorted(set(primes)):
+        found = [d * p ** k for d in found for k in range(primes.count(p) + 1)]
+    return sorted(found)
+
+
+def rational_root_candidates(coeffs):
+    """
+    Every p/q with p dividing the constant and q the leading coefficient, positive before negative
+    by size, for integer coeffs whose constant isn't 0
+    """
+    # Only p and q with no common factor, so each candidate comes up once without reducing fractions
+    leads = divisors(coeffs[0])
+    pairs = sorted(((p, q) for p in divisors(coeffs[-1]) for q in leads if gcd(p, q) == 1),
+                   key=lambda pq: pq[0] / pq[1])
+    return [r for p, q in pairs for r in ((p, -p) if q == 1 else (Fraction(p, q), Fraction(-p, q)))]
+
+
+def rational_roots(coeffs):
+    """
+    Finds the rational roots of a polynomial with rational coefficients, highest degree first
+    Returns the candidates from the rational root theorem and the deflation steps, a (root, row)
+    for every root counted with multiplicity, each row dividing the quotient left by the step
+    before. Roots of a quotient are roots of the polynomial, so after the first batch only the
+    roots already found are tried again.
+    """
+    coeffs = integer_coefficients(coeffs)
+    steps = []
+    while len(coeffs) > 1 and coeffs[-1] == 0:
+        steps.append((0, coeffs[:-1] + [0]))
+        coeffs = coeffs[:-1]
+    if len(coeffs) == 1:
+        return [], steps
+
+    candidates = rational_root_candidates(coeffs)
+    _, survivors = horner_batch(coeffs, candidates, rows=False)
+    while survivors and len(coeffs) > 1:
+        row = horner(coeffs, survivors[0])
+        steps.append((survivors[0], row))
+        # The quotient by x - p/q is q times an integer polynomial, so its coefficients are ints
+        coeffs = [int(b) for b in row[:-1]]
+        _, survivors = horner_batch(coeffs, survivors, rows=False)
+    return candidates, steps
+
+
+@lru_cache(maxsize=None)
+def power_latex(x, k):
+    """LaTeX for x**k, '' for the constant term"""
+    return sym.latex(x ** k) if k != 0 else ''
+
+
+def number_latex(c):
+    """sym.latex of a coefficient, without sympy for ints and Fractions"""
+    if isinstance(c, int):
+        return str(c)
+    if isinstance(c, Fraction):
+        if c.denominator == 1:
+            return str(c.numerator)
+        return "%s\\frac{%d}{%d}" % ("- " if c < 0 else "", abs(c.numerator), c.denominator)
+    return sym.latex(c)
@@ -0,0 +1,174 @@
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import sympy as sym
+
+from app import app
+from app import cost
+from app import engines
+from app import metrics
+from app import parse
+from app import plotting
+from app import svg as svg_backend
+from app import tools
+from app.minify import minify
+from app.store import open_store
+from app.texpool import TexWorkerPool
+
+STATIC = Path(__file__).parent / 'static'
+
+TEMPLATES = {
+    'factor_tree': 'factor_tree_template.tex',
+    'plotter': 'plotter_template.tex',
+    'num_line_inequality': 'num_line_template.tex',
+}
+
+# What each image tool's arguments turn into, TikZ for the templates above or a finished svg
+TIKZ = {
+    'factor_tree': tools.factor_tree,
+    'plotter': tools.create_graph,
+    'num_line_inequality': tools.number_line_inequality,
+}
+SVG = {
+    'factor_tree': svg_backend.factor_tree,
+    'plotter': plotting.svg_graph,
+    'num_line_inequality': svg_backend.number_line_inequality,
+}
+
+
+# Arguments of a typical figure for each tool, what the engines are benchmarked on
+SAMPLES = {
+    'factor_tree': [(360,), (1001,)],
+    'plotter': [(sym.sympify('x**3/8 - 2*x'),), ((sym.sympify('sin(x)'), sym.sympify('x/2')),)],
+    'num_line_inequality': [(-5, 5, parse.ray(sym.Rational(3, 2), '<=')),
+                            (-1, sym.Rational(3, 2), parse.parse_inequality('-1/2 < x <= 1/4 or x > 1'))],
+}
+
+
+@lru_cache(maxsize=None)
+def _template_text(tool):
+    return (STATIC / TEMPLATES[tool]).read_text()
+
+
+store = open_store(app.config)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def engine(tool):
+    """The TeX engine configured for the tool's template, or the one app.engines picks for it"""
+    bodies = None
+    if app.config['TEX_ENGINE_BENCHMARK']:
+        bodies = [TIKZ[tool](*args) for args in SAMPLES[tool]]
+    return engines.choose(STATIC / TEMPLATES[tool], app.config['TEX_ENGINES'].get(tool, app.config['TEX_ENGINE']),
+                          bodies, app.config['TEX_JOB_TIMEOUT'], app.config['RENDER_SCRATCH_DIR'])
+
+
+def pool(tool):
+    """Returns the tool's worker pool, starting it on first use so that forked workers each get their own"""
+    with _pools_lock:
+        if tool not in _pools:
+            _pools[tool] = TexWorkerPool(STATIC / TEMPLATES[tool], app.config['TEX_POOL_SIZE'],
+                                         app.config['TEX_QUEUE_DEPTH'], app.config['TEX_JOB_TIMEOUT'],
+                                         app.config['RENDER_SCRATCH_DIR'], engine(tool),
+                                         app.config['TEX_MAX_MEMORY'], app.config['TEX_MAX_OUTPUT'])
+        return _pools[tool]
+
+
+def compile_svgs(tool, bodies):
+    """Compiles all bodies on a warm TeX worker in a single run, returns the svg paths in order"""
+    return pool(tool).render_batch(bodies)
+
+
+def url(key):
+    return f'/renders/{key}.svg'
+
+
+def svg_at(url):
+    """The svg behind a /renders url as bytes, or None once it has been dropped from the store"""
+    return store.get(url.rsplit('/', 1)[1].removesuffix('.svg'))
+
+
+def image_key(tool, body):
+    return store.key(tool, _template_text(tool), body)
+
+
+def svg_key(tool, svg):
+    return store.key('svg', tool, svg)
+
+
+def cached_url(key):
+    """The url for key if it has been rendered, otherwise None"""
+    return url(key) if store.exists(key) else None
+
+
+def render_images(tool, bodies):
+    """
+    Returns the urls of the svgs for every body rendered with tool's template
+    Bodies that aren't stored yet are compiled together as the pages of one document,
+    see render_once for when another worker is already compiling some of them.
+    """
+    keys = [image_key(tool, body) for body in bodies]
+    render_once(tool, {key: body for key, body in zip(keys, bodies)})
+    return [url(key) for key in keys]
+
+
+def render_once(tool, bodies, poll=.05):
+    """
+    Stores the minified svgs of whichever of bodies, by key, aren't stored yet, claiming each first
+    The bodies this worker claims are compiled here, and for those claimed elsewhere it waits
+    until they are stored, or until their claim is given up or runs out and it can take them over.
+    """
+    while True:
+        missing = {key: body for key, body in bodies.items() if not store.exists(key)}
+        if not missing:
+            return
+        claimed = [key for key in missing if store.claim(key)]
+        try:
+            # Stored by whoever held the claim between the look and the claim
+            claimed = [key for key in claimed if not store.exists(key)]
+            if claimed:
+                for key, svg in zip(claimed, compile_svgs(tool, [missing[key] for key in claimed])):
+                    with metrics.stage('minify'):
+                        data = minify(svg.read_bytes())
+                        svg.unlink()
+                    with metrics.stage('cache'):
+                        store.put(key, data)
+            elif missing:
+                with metrics.stage('wait'):
+                    time.sleep(poll)
+        finally:
+            for key in claimed:
+                store.release(key)
+
+
+def store_svg(tool, svg):
+    """Stores an svg drawn in process, returns its url"""
+    key = svg_key(tool, svg)
+    if not store.exists(key):
+        with metrics.stage('minify'):
+            data = minify(svg.encode('utf-8'))
+        with metrics.stage('cache'):
+            store.put(key, data)
+    return url(key)
+
+
+def render_figures(tool, arguments, renderer='tex'):
+    """
+    Returns the urls of the tool's figure for each tuple of arguments
+    renderer 'tex' compiles the TikZ from tools with a TeX engine, 'svg' draws the figures in process.
+    Each figure goes through app.cost first, which raises TooExpensive for any that would be too big.
+    """
+    arguments = [cost.admit(tool, args) for args in arguments]
+    if renderer == 'svg':
+        with metrics.stage('svg'):
+            svgs = [SVG[tool](*args) for args in arguments]
+        return [store_svg(tool, svg) for svg in svgs]
+    with metrics.stage('tikz'):
+        bodies = [TIKZ[tool](*args) for args in arguments]
+    return render_images(tool, bodies)
+
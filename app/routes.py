@@ -1,22 +1,27 @@
 from app import app
 import random
-from flask import render_template, flash, redirect, url_for
+import sys
+from flask import render_template, flash, redirect, url_for, request, jsonify, abort, make_response
 from app.forms import PolynomialLongDiv
 from app.forms import SyntheticDivision
+from app.forms import RationalRoots
 from app.forms import VerticalAddition
 from app.forms import VerticalSubtraction
 from app.forms import IntegerLongDiv
 from app.forms import GraphPlotter
 from app.forms import FactorTree
 from app.forms import NumberLine
+from app.forms import read_form
+from app import metrics
 
-import subprocess
-import os
-from pathlib import Path
-from app import tools
-import sympy as sym
-from shutil import copyfile
-import hashlib
+# Sympy, numpy and the tools that use them are imported by the views that need them, so
+# a worker can serve pages as soon as it starts. Set PRELOAD to import them up front.
+
+
+def preload():
+    """Imports everything the views would load on first use"""
+    from app import api, engines, jobs, memo, render, tools  # noqa: F401
+    engines.installed()
 
 
 @app.route('/')
@@ -25,35 +30,64 @@ def index():
     return render_template('index.html')
 
 
+def busy(template, **context):
+    """The tool's page with a 429 when the render queue is full"""
+    return render_template(template, busy=True, **context), 429, {'Retry-After': '5'}
+
+
+@app.route('/jobs/<job>')
+def job_status(job):
+    """Polled by the image pages until the job's svg is ready"""
+    from app.jobs import jobs
+    status = jobs.status(job)
+    return jsonify(status), 404 if status['status'] == 'unknown' else 200
+
+
+@app.route('/renders/<key>.svg')
+def rendered(key):
+    """
+    A rendered svg from the store, whichever worker or node rendered it
+    Sent brotli or gzip compressed when the client accepts it, from the variants stored with the svg.
+    The key is the hash of what the svg was drawn from, so the response never changes and may be cached
+    for good, and each encoding has an ETag of its own.
+    """
+    from app.store import ENCODINGS
+    from app.render import store
+    if len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+        abort(404)
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    svg = store.get(key, encoding) if encoding else None
+    if svg is None:
+        encoding, svg = None, store.get(key)
+    if svg is None:
+        abort(404)
+    response = make_response(svg)
+    response.mimetype = 'image/svg+xml'
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    response.set_etag(f'{key}-{encoding}' if encoding else key)
+    return response.make_conditional(request)
+
+
 @app.route('/num_line_inequality', methods=['GET', 'POST'])
 def num_line_inequality():
     form = NumberLine()
     if form.validate_on_submit():
-        first, last, a, relation = sym.sympify(form.first.data), sym.sympify(form.last.data), \
-                                   sym.sympify(form.a.data), str(form.relation.data)
-
-        path = Path('.') / 'app/static'
-        filename = f"number_line_{str(random.randint(1111, 3333))}"
-        copyfile("app/static/num_line_template.tex", f"app/static/{filename}" + ".tex")
-
-        with open(f"app/static/{filename}" + ".tex", "a") as file:
-            file.write(tools.number_line_inequality(first, last, a, relation) + "\\end{document}")
-
-        # Compile LaTeX file to a pdf
-        p = subprocess.Popen(["xelatex", "--shell-escape", f"{filename}.tex"], cwd=path)
-        p.wait()
-
-        # Convert the pdf to an svg
-        if os.path.exists(f'{filename}.svg'):
-            os.remove(f'{filename}.svg')
-        subprocess.call(["pdf2svg", f'{filename}.pdf', f'{filename}.svg'], cwd=path)
-
-        # Clean up files
-        files_to_remove = [".aux", ".log", ".pdf", ".tex"]
-        for extension in files_to_remove:
-            os.remove(path / f'{filename}{extension}')
-
-        flash(f'/static/{filename}.svg')
+        from app.cost import TooExpensive
+        from app.jobs import jobs, QueueFull
+        try:
+            job = jobs.submit('num_line_inequality', form.first.parsed, form.last.parsed, form.solution,
+                              renderer=form.renderer.data)
+        except QueueFull:
+            return busy('num_line_inequality.html', title='Number Line Inequality', form=form)
+        except TooExpensive as e:
+            form.last.errors.append(str(e))
+            return render_template('num_line_inequality.html', title='Number Line Inequality', form=form)
+        flash(url_for('job_status', job=job))
         return redirect('/num_line_inequality')
     return render_template('num_line_inequality.html', title='Number Line Inequality', form=form)
 
@@ -62,30 +96,16 @@ def num_line_inequality():
 def factor_tree():
     form = FactorTree()
     if form.validate_on_submit():
-        n = sym.sympify(form.function.data)
-
-        path = Path('.') / 'app/static'
-        filename = f"factor_tree_{str(random.randint(1111, 3333))}"
-        copyfile("app/static/factor_tree_template.tex", f"app/static/{filename}" + ".tex")
-
-        with open(f"app/static/{filename}" + ".tex", "a") as file:
-            file.write(tools.factor_tree(n) + "\\end{document}")
-
-        # Compile LaTeX file to a pdf
-        p = subprocess.Popen(["xelatex", "--shell-escape", f"{filename}.tex"], cwd=path)
-        p.wait()
-
-        # Convert the pdf to an svg
-        if os.path.exists(f'{filename}.svg'):
-            os.remove(f'{filename}.svg')
-        subprocess.call(["pdf2svg", f'{filename}.pdf', f'{filename}.svg'], cwd=path)
-
-        # Clean up files
-        files_to_remove = [".aux", ".log", ".pdf", ".tex"]
-        for extension in files_to_remove:
-            os.remove(path / f'{filename}{extension}')
-
-        flash(f'/static/{filename}.svg')
+        from app.cost import TooExpensive
+        from app.jobs import jobs, QueueFull
+        try:
+            job = jobs.submit('factor_tree', form.function.parsed, renderer=form.renderer.data)
+        except QueueFull:
+            return busy('factor_tree.html', title='Factor Tree', form=form)
+        except TooExpensive as e:
+            form.function.errors.append(str(e))
+            return render_template('factor_tree.html', title='Factor Tree', form=form)
+        flash(url_for('job_status', job=job))
         return redirect('/factor_tree')
     return render_template('factor_tree.html', title='Factor Tree', form=form)
 
@@ -94,43 +114,174 @@ def factor_tree():
 def plotter():
     form = GraphPlotter()
     if form.validate_on_submit():
-        f = sym.sympify(form.function.data)
-        if form.validate_on_submit():
-            f = sym.sympify(form.function.data)
-
-            path = Path('.') / 'app/static'
-            filename = f"graph_{str(random.randint(1111, 3333))}"
-            copyfile("app/static/plotter_template.tex", f"app/static/{filename}" + ".tex")
-
-            with open(f"app/static/{filename}" + ".tex", "a") as file:
-                file.write(tools.create_graph(f) + "\\end{document}")
-
-            # Compile LaTeX file to a pdf
-            p = subprocess.Popen(["xelatex", "--shell-escape", f"{filename}.tex"], cwd=path)
-            p.wait()
-
-            # Convert the pdf to an svg
-            if os.path.exists(f'{filename}.svg'):
-                os.remove(f'{filename}.svg')
-            subprocess.call(["pdf2svg", f'{filename}.pdf', f'{filename}.svg'], cwd=path)
-
-            # Clean up files
-            files_to_remove = [".aux", ".log", ".pdf", ".tex"]
-            for extension in files_to_remove:
-                os.remove(path / f'{filename}{extension}')
-
-            flash(f'/static/{filename}.svg')
+        from app.cost import TooExpensive
+        from app.jobs import jobs, QueueFull
+        try:
+            job = jobs.submit('plotter', form.function.parsed, renderer=form.renderer.data)
+        except QueueFull:
+            return busy('plotter.html', title='Graph a Function', form=form)
+        except TooExpensive as e:
+            form.function.errors.append(str(e))
+            return render_template('plotter.html', title='Graph a Function', form=form)
+        flash(url_for('job_status', job=job))
         return redirect('/plotter')
     return render_template('plotter.html', title='Graph a Function', form=form)
 
 
+# Each image tool's form and the arguments its figure is drawn from
+IMAGE_INPUTS = {
+    'num_line_inequality': (NumberLine, lambda form: (form.first.parsed, form.last.parsed, form.solution)),
+    'factor_tree': (FactorTree, lambda form: (form.function.parsed,)),
+    'plotter': (GraphPlotter, lambda form: (form.function.parsed,)),
+}
+
+
+@app.route('/batch/<tool>', methods=['POST'])
+def batch(tool):
+    """
+    Renders many figures for one image tool in a single TeX run
+    Takes a json list of inputs keyed like the tool's form fields,
+    e.g. [{"function": "60"}, {"function": "84", "renderer": "svg"}] for /batch/factor_tree,
+    and returns {"images": [...]} with the svg urls in the same order. An input too big to draw
+    is a 400 like invalid ones, a figure TeX fails on or is killed over a 422.
+    """
+    if tool not in IMAGE_INPUTS:
+        abort(404)
+    inputs = request.get_json(silent=True)
+    if not isinstance(inputs, list) or not inputs:
+        return jsonify(error='expected a non-empty json list of inputs'), 400
+    if len(inputs) > app.config['RENDER_BATCH_MAX']:
+        return jsonify(error=f"at most {app.config['RENDER_BATCH_MAX']} inputs per batch"), 413
+
+    from app import cost, parse, render
+    from app.texpool import TexError, TexQueueFull
+
+    form_class, arguments = IMAGE_INPUTS[tool]
+    groups = {}
+    for index, data in enumerate(inputs):
+        if not isinstance(data, dict):
+            return jsonify(index=index, errors={'input': ['expected an object of form fields']}), 400
+        form = read_form(form_class, data)
+        if form.errors:
+            return jsonify(index=index, errors=form.errors), 400
+        try:
+            args = cost.admit(tool, arguments(form))
+        except parse.ParseError as e:
+            return jsonify(index=index, errors={'input': [str(e)]}), 400
+        except cost.TooExpensive as e:
+            return jsonify(index=index, errors={'input': [str(e)]}), 400
+        groups.setdefault(form.renderer.data, []).append((index, args))
+
+    images = [None] * len(inputs)
+    for renderer, group in groups.items():
+        try:
+            urls = render.render_figures(tool, [args for _, args in group], renderer)
+        except TexQueueFull as e:
+            return jsonify(error=str(e)), 429, {'Retry-After': '5'}
+        except TexError as e:
+            return jsonify(error=str(e)), 422
+        for (index, _), url in zip(group, urls):
+            images[index] = url
+    return jsonify(images=images)
+
+
+def cacheable(response):
+    """The tools are deterministic, so results get an ETag and may be cached, and a matching If-None-Match is a 304"""
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['API_MAX_AGE']
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/metrics')
+def metrics_text():
+    """Request and stage timings, error and exit code counts for this process, for Prometheus to scrape"""
+    gauges = []
+    if 'app.memo' in sys.modules:
+        stats = sys.modules['app.memo'].results.stats()
+        gauges += [('sme_memo_hits_total', (), stats['hits']), ('sme_memo_disk_hits_total', (), stats['disk_hits']),
+                   ('sme_memo_misses_total', (), stats['misses'])]
+    if 'app.jobs' in sys.modules:
+        gauges.append(('sme_render_jobs_pending', (), sys.modules['app.jobs'].jobs.pending()))
+    return metrics.registry.exposition(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/api/v1/memo')
+def memo_stats():
+    """Hit and miss counts for the text tools' results cache in this process"""
+    from app import memo
+    return jsonify(memo.results.stats())
+
+
+@app.route('/api/v1/<tool>', methods=['GET', 'POST'])
+def api_v1(tool):
+    """
+    LaTeX for one input to a text tool, as {"latex": ...}
+    The input is keyed like the tool's form fields, in the query string or a json body,
+    e.g. /api/v1/int_long_div?dividend=1234&divisor=7
+    """
+    from app import api
+    if tool not in api.TEXT_TOOLS:
+        abort(404)
+    data = request.args.to_dict() if request.method == 'GET' else request.get_json(silent=True)
+    result = api.evaluate(tool, data)
+    if 'latex' not in result:
+        return jsonify(result), 400
+    return cacheable(jsonify(result))
+
+
+@app.route('/api/v1/<tool>/batch', methods=['POST'])
+def api_v1_batch(tool):
+    """
+    LaTeX for a json list of inputs to a text tool, evaluated across worker processes
+    Returns {"results": [...]} in the same order, each {"latex": ...} or {"errors": ...} by field.
+    """
+    from app import api
+    if tool not in api.TEXT_TOOLS:
+        abort(404)
+    inputs = request.get_json(silent=True)
+    if not isinstance(inputs, list) or not inputs:
+        return jsonify(error='expected a non-empty json list of inputs'), 400
+    if len(inputs) > app.config['API_BATCH_MAX']:
+        return jsonify(error=f"at most {app.config['API_BATCH_MAX']} inputs per batch"), 413
+    return cacheable(jsonify(results=api.pool.evaluate(tool, inputs)))
+
+
+@app.route('/worksheet/<kind>')
+def worksheet(kind):
+    """
+    A worksheet of count random problems of one kind with answers, streamed as it is generated
+    e.g. /worksheet/int_long_div?count=500&seed=7 for a LaTeX document, add &format=jsonl
+    for one json object per problem. The same seed always gives the same worksheet.
+    """
+    from app import worksheet as worksheets
+    if kind not in worksheets.KINDS:
+        abort(404)
+    count = request.args.get('count', 20, type=int)
+    seed = request.args.get('seed', 0, type=int)
+    form = request.args.get('format', 'tex')
+    if not 0 < count <= app.config['WORKSHEET_MAX_PROBLEMS'] or form not in ('tex', 'jsonl'):
+        return jsonify(error=f"count must be 1 to {app.config['WORKSHEET_MAX_PROBLEMS']}, "
+                             f"format tex or jsonl"), 400
+
+    problems = worksheets.problems(kind, count, seed, app.config['WORKSHEET_PROCESSES'])
+    if form == 'jsonl':
+        body, mimetype = worksheets.json_lines(kind, problems), 'application/x-ndjson'
+    else:
+        body, mimetype = worksheets.latex_document(kind, problems), 'application/x-tex'
+    return app.response_class(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={kind}_{seed}_{count}.{form}'})
+
+
 @app.route('/int_long_div', methods=['GET', 'POST'])
 def int_long_div():
     form = IntegerLongDiv()
     if form.validate_on_submit():
-        a = sym.sympify(form.dividend.data)
-        d = sym.sympify(form.divisor.data)
-        flash('{}'.format(tools.int_long_division(a, d)))
+        from app import tools
+        a = form.dividend.parsed
+        d = form.divisor.parsed
+        with metrics.stage('latex'):
+            flash('{}'.format(tools.int_long_division(a, d)))
         return redirect('/int_long_div')
     return render_template('int_long_div.html', title='Integer Long Division', form=form)
 
@@ -139,9 +290,11 @@ def int_long_div():
 def poly_long_div():
     form = PolynomialLongDiv()
     if form.validate_on_submit():
-        a = sym.sympify(form.dividend.data)
-        d = sym.sympify(form.divisor.data)
-        flash('{}'.format(tools.poly_long_division(a, d)))
+        from app import tools
+        a = form.dividend.parsed
+        d = form.divisor.parsed
+        with metrics.stage('latex'):
+            flash('{}'.format(tools.poly_long_division(a, d)))
         return redirect('/poly_long_div')
     return render_template('poly_long_div.html', title='Polynomial Long Division', form=form)
 
@@ -150,19 +303,35 @@ def poly_long_div():
 def synth_div():
     form = SyntheticDivision()
     if form.validate_on_submit():
-        a = sym.sympify(form.dividend.data)
-        d = sym.sympify(form.divisor.data)
-        flash('{}'.format(tools.synthetic_division(a, d)))
+        from app import tools
+        a = form.dividend.parsed
+        d = form.divisor.parsed
+        with metrics.stage('latex'):
+            flash('{}'.format(tools.synthetic_division(a, d)))
         return redirect('/synth_div')
     return render_template('synth_div.html', title='Synthetic Division', form=form)
 
 
+@app.route('/rational_roots', methods=['GET', 'POST'])
+def rational_roots():
+    form = RationalRoots()
+    if form.validate_on_submit():
+        from app import tools
+        f = form.polynomial.parsed
+        with metrics.stage('latex'):
+            flash('{}'.format(tools.rational_roots(f)))
+        return redirect('/rational_roots')
+    return render_template('rational_roots.html', title='Rational Roots', form=form)
+
+
 @app.route('/vert_add', methods=['GET', 'POST'])
 def vert_add():
     form = VerticalAddition()
     if form.validate_on_submit():
-        a = [int(k) for k in list(sym.sympify(form.addends.data))]
-        flash('{}'.format(tools.vertical_addition(*a)))
+        from app import tools
+        a = form.addends.parsed
+        with metrics.stage('latex'):
+            flash('{}'.format(tools.vertical_addition(*a)))
         return redirect('/vert_add')
     return render_template('vert_add.html', title='Vertical Addition', form=form)
 
@@ -171,8 +340,10 @@ def vert_add():
 def vert_sub():
     form = VerticalSubtraction()
     if form.validate_on_submit():
-        a = [int(k) for k in list(sym.sympify(form.subtrahends.data))]
-        flash('{}'.format(tools.vertical_subtraction(*a)))
+        from app import tools
+        a = form.subtrahends.parsed
+        with metrics.stage('latex'):
+            flash('{}'.format(tools.vertical_subtraction(*a)))
         return redirect('/vert_sub')
     return render_template('vert_sub.html', title='Vertical Subtraction', form=form)
 
@@ -0,0 +1,275 @@
+"""
+Where rendered SVGs are kept, shared by every worker process and, given shared storage, every node
+An svg is stored under the sha256 of what it was drawn from, so what a key holds never changes
+and /renders/<key>.svg can be cached by browsers and proxies for good. There are two backends:
+DiskStore keeps a file per key in a directory, on local disk or on a mount every node shares,
+and SQLiteStore keeps them all in one database file, a stand-in for an object store.
+Both bound their size, dropping the least recently used svgs, and both give single flight:
+claim leases a key to one process of all those sharing the store, until it is released
+or the lease runs out, so a figure asked for everywhere at once is only rendered once.
+Every svg is stored gzipped, and with brotli when it is installed, alongside the plain one,
+so it can be served compressed without compressing it again for every request.
+"""
+import gzip
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    # Only gzip then, which every browser accepts anyway
+    brotli = None
+
+# Content codings every svg is stored in besides identity, best first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+SUFFIXES = {None: '.svg', 'gzip': '.svg.gz', 'br': '.svg.br'}
+
+# Reads of an svg more often than this many seconds apart only mark it as used once
+TOUCH_INTERVAL = 60
+
+
+def encoded(svg):
+    """The svg in each of ENCODINGS, compressed as hard as they go since it's done once per figure"""
+    variants = {'gzip': gzip.compress(svg, 9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(svg, quality=11)
+    return variants
+
+
+class Store(object):
+    """What both backends share: the keys, and the reaper thread keeping them under max_bytes"""
+
+    def __init__(self, max_bytes, reap_interval=60, lease=300):
+        self.max_bytes = max_bytes
+        self.reap_interval = reap_interval
+        self.lease = lease
+        self.reaper = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def start_reaper(self):
+        # Threads don't survive a fork, so this also restarts the reaper in forked workers
+        with self.lock:
+            if self.reaper is None or not self.reaper.is_alive():
+                self.reaper = threading.Thread(target=self._reap_forever, name='render_store_reaper', daemon=True)
+                self.reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            self.reap()
+            time.sleep(self.reap_interval)
+
+
+class DiskStore(Store):
+    """
+    Each svg as <key>.svg in directory, and <key>.svg.gz and <key>.svg.br beside it
+    Files are renamed into place whole so readers never see a partial one, and the svg goes first,
+    since a missing variant only means sending it uncompressed. The svg's mtime doubles as the
+    last access time of all three. A claim is a <key>.lock file made with O_EXCL,
+    which only one process can create, on one machine or across NFS.
+    """
+
+    def __init__(self, directory, max_bytes, reap_interval=60, lease=300):
+        super().__init__(max_bytes, reap_interval, lease)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key, encoding=None):
+        return self.directory / f'{key}{SUFFIXES[encoding]}'
+
+    def exists(self, key):
+        return self.path(key).exists()
+
+    def get(self, key, encoding=None):
+        """The svg stored under key as bytes, in encoding if given, marking it as recently used, or None"""
+        try:
+            svg = self.path(key, encoding).read_bytes()
+            path = self.path(key)
+            if time.time() - path.stat().st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+        return svg
+
+    def put(self, key, svg):
+        for encoding, data in [(None, svg)] + list(encoded(svg).items()):
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                os.replace(tmp, self.path(key, encoding))
+            except BaseException:
+                os.remove(tmp)
+                raise
+        self.start_reaper()
+
+    def claim(self, key):
+        """True if this process now holds key, False while another does"""
+        lock = self.directory / f'{key}.lock'
+        for _ in range(2):
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - lock.stat().st_mtime < self.lease:
+                        return False
+                    # Left by a worker that died, or is taking far too long
+                    os.remove(lock)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def release(self, key):
+        try:
+            os.remove(self.directory / f'{key}.lock')
+        except FileNotFoundError:
+            pass
+
+    def reap(self, stale_after=600):
+        """
+        Removes temporary files, locks and variants without an svg abandoned for stale_after seconds,
+        then trims the store to max_bytes, an svg and its variants at a time
+        """
+        now = time.time()
+        used, sizes, orphans = {}, {}, []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith(('.tmp', '.lock')) and now - stat.st_mtime > max(stale_after, self.lease):
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            key, _, suffix = entry.name.partition('.')
+            if '.' + suffix in SUFFIXES.values():
+                sizes[key] = sizes.get(key, 0) + stat.st_size
+                if suffix == 'svg':
+                    used[key] = stat.st_mtime
+                elif now - stat.st_mtime > stale_after:
+                    orphans.append(key)
+
+        def remove(key):
+            for suffix in SUFFIXES.values():
+                try:
+                    os.remove(self.directory / f'{key}{suffix}')
+                except FileNotFoundError:
+                    pass
+
+        for key in orphans:
+            if key not in used:
+                remove(key)
+        total = sum(sizes[key] for key in used)
+        for key in sorted(used, key=used.get):
+            if total <= self.max_bytes:
+                break
+            remove(key)
+            total -= sizes[key]
+
+
+class SQLiteStore(Store):
+    """
+    Every svg as a row of one SQLite database, with its variants and the time it was last used
+    Claims are rows of a leases table, inserted in a transaction so only one process gets each.
+    The database is in WAL mode, so serving svgs doesn't wait on a worker storing one.
+    """
+
+    def __init__(self, path, max_bytes, reap_interval=60, lease=300):
+        super().__init__(max_bytes, reap_interval, lease)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.local = threading.local()
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS svgs (key TEXT PRIMARY KEY, svg BLOB NOT NULL, gzip BLOB, br BLOB, '
+                       'size INTEGER NOT NULL, used REAL NOT NULL)')
+            # Added after the first stores were made
+            for column in {'gzip', 'br'} - {row[1] for row in db.execute('PRAGMA table_info(svgs)')}:
+                db.execute(f'ALTER TABLE svgs ADD COLUMN {column} BLOB')
+            db.execute('CREATE INDEX IF NOT EXISTS svgs_used ON svgs (used)')
+            db.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)')
+
+    def connection(self):
+        """This thread's connection, made again after a fork since sqlite connections can't cross one"""
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def exists(self, key):
+        return self.connection().execute('SELECT 1 FROM svgs WHERE key = ?', (key,)).fetchone() is not None
+
+    def get(self, key, encoding=None):
+        """The svg stored under key as bytes, in encoding if given, marking it as recently used, or None"""
+        db = self.connection()
+        column = {None: 'svg', 'gzip': 'gzip', 'br': 'br'}[encoding]
+        row = db.execute(f'SELECT {column}, used FROM svgs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            db.execute('UPDATE svgs SET used = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key, svg):
+        variants = encoded(svg)
+        self.connection().execute('INSERT OR REPLACE INTO svgs (key, svg, gzip, br, size, used) VALUES (?, ?, ?, ?, ?, ?)',
+                                  (key, svg, variants.get('gzip'), variants.get('br'),
+                                   len(svg) + sum(map(len, variants.values())), time.time()))
+        self.start_reaper()
+
+    def claim(self, key):
+        """True if this process now holds key, False while another does"""
+        db = self.connection()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('DELETE FROM leases WHERE key = ? AND expires < ?', (key, now))
+            claimed = db.execute('INSERT OR IGNORE INTO leases VALUES (?, ?)', (key, now + self.lease)).rowcount == 1
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def release(self, key):
+        self.connection().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+    def reap(self):
+        """Drops expired leases, then the least recently used svgs until the rest fit in max_bytes"""
+        db = self.connection()
+        db.execute('DELETE FROM leases WHERE expires < ?', (time.time(),))
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM svgs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in db.execute('SELECT key, size FROM svgs ORDER BY used'):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        db.executemany('DELETE FROM svgs WHERE key = ?', doomed)
+
+
+def open_store(config):
+    """The store app.config asks for in RENDER_STORE"""
+    if config['RENDER_STORE'] == 'sqlite':
+        return SQLiteStore(config['RENDER_STORE_PATH'], config['RENDER_CACHE_MAX_BYTES'],
+                           config['RENDER_REAP_INTERVAL'], config['RENDER_LEASE'])
+    if config['RENDER_STORE'] == 'disk':
+        return DiskStore(config['RENDER_CACHE_DIR'], config['RENDER_CACHE_MAX_BYTES'],
+                         config['RENDER_REAP_INTERVAL'], config['RENDER_LEASE'])
+    raise ValueError(f"RENDER_STORE must be 'disk' or 'sqlite', not {config['RENDER_STORE']!r}")
@@ -0,0 +1,202 @@
+# coding=utf-8
+"""
+Draws factor trees and number lines straight to SVG, without TeX
+Dimensions are in TeX points and follow what forest and TikZ produce for the
+templates in app/static, so the images can stand in for the compiled ones.
+"""
+from math import hypot
+
+import sympy as sym
+
+from app import factor
+from app import ticks
+
+PT_PER_CM = 28.4528
+FONT = 'font-family="Latin Modern Roman, CMU Serif, serif"'
+
+# Advance widths of Computer Modern glyphs at 1pt
+CHAR_WIDTHS = {'-': .778, '.': .278, '/': .5}
+# Height of a digit and the default inner sep of a TikZ node
+DIGIT_HEIGHT = .644
+INNER_SEP = 3.333
+
+THIN = .4
+THICK = .8
+ULTRA_THICK = 1.6
+
+
+def text_width(text, size):
+    return sum(CHAR_WIDTHS.get(char, .5) for char in text) * size
+
+
+def svg_document(elements, left, top, right, bottom, margin=1):
+    """Wraps the elements in an svg whose viewBox covers left, top, right, bottom"""
+    left, top, right, bottom = left - margin, top - margin, right + margin, bottom + margin
+    width, height = right - left, bottom - top
+    return f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.2f}pt" height="{height:.2f}pt" ' \
+           f'viewBox="{left:.2f} {top:.2f} {width:.2f} {height:.2f}">' + "".join(elements) + '</svg>'
+
+
+def svg_text(text, x, baseline, size, color='black'):
+    return f'<text x="{x:.2f}" y="{baseline:.2f}" font-size="{size}" {FONT} fill="{color}" ' \
+           f'text-anchor="middle">{text}</text>'
+
+
+def svg_line(x1, y1, x2, y2, width, color='black'):
+    return f'<line x1="{x1:.2f}" y1="{y1:.2f}" x2="{x2:.2f}" y2="{y2:.2f}" stroke="{color}" ' \
+           f'stroke-width="{width}"/>'
+
+
+def svg_arrow_tip(x, y, direction, width, color='black'):
+    """A filled TikZ latex tip whose point sits at x, y, facing right for direction 1 and left for -1"""
+    length = 3.5 + 3 * width
+    half = .4 * length
+    base = x - direction * length
+    return f'<path d="M {x:.2f} {y:.2f} Q {base + direction * length / 3:.2f} {y:.2f} {base:.2f} {y - half:.2f} ' \
+           f'L {base:.2f} {y + half:.2f} Q {base + direction * length / 3:.2f} {y:.2f} {x:.2f} {y:.2f} Z" ' \
+           f'fill="{color}"/>'
+
+
+def svg_bracket_tip(x, y, direction, width, closed, color='black'):
+    """
+    The [ or ( tip at x, y opening towards direction
+    closed gives a square bracket, otherwise a parenthesis.
+    """
+    half = 2.5 + 1.5 * width
+    reach = x + direction * (1 + width)
+    if closed:
+        d = f'M {reach:.2f} {y - half:.2f} L {x:.2f} {y - half:.2f} L {x:.2f} {y + half:.2f} L {reach:.2f} {y + half:.2f}'
+    else:
+        bulge = x - direction * (1 + width)
+        d = f'M {reach:.2f} {y - half:.2f} Q {bulge:.2f} {y:.2f} {reach:.2f} {y + half:.2f}'
+    return f'<path d="{d}" fill="none" stroke="{color}" stroke-width="{width}"/>'
+
+
+def factor_tree(number, size=10):
+    """
+    SVG for the factor tree of number, laid out like tools.factor_tree's forest output
+    Every level splits off the smallest prime factor as a circled left leaf and
+    continues with the cofactor on the right, the last prime is circled too.
+    """
+    level_distance = 2.8 * size
+    sibling_sep = 1.2 * size
+    text_height = DIGIT_HEIGHT * size
+
+    def half_width(label):
+        return text_width(label, size) / 2 + INNER_SEP
+
+    def radius(label):
+        return hypot(half_width(label), text_height / 2 + INNER_SEP)
+
+    # Each node is (label, circled, x, y), each edge a pair of node indices
+    nodes = []
+    edges = []
+    node = factor.factor_tree(number)
+    x, y = 0, 0
+    parent = None
+    while True:
+        nodes.append((str(node.value), not node.children, x, y))
+        if parent is not None:
+            edges.append((parent, len(nodes) - 1))
+        parent = len(nodes) - 1
+        if not node.children:
+            break
+
+        prime, node = node.children
+        divisor, cofactor = str(prime.value), str(node.value)
+        spread = max((radius(divisor) + half_width(cofactor) + sibling_sep) / 2, sibling_sep)
+        nodes.append((divisor, True, x - spread, y + level_distance))
+        edges.append((parent, len(nodes) - 1))
+        x, y = x + spread, y + level_distance
+
+    def border(node, towards):
+        """Where the edge from node towards the other node leaves its circle or text box"""
+        label, circled, x, y = node
+        dx, dy = towards[2] - x, towards[3] - y
+        distance = hypot(dx, dy)
+        if circled:
+            reach = radius(label)
+        else:
+            reach = min(half_width(label) * distance / abs(dx) if dx else float('inf'),
+                        (text_height / 2 + INNER_SEP) * distance / abs(dy) if dy else float('inf'))
+        return x + dx * reach / distance, y + dy * reach / distance
+
+    elements = []
+    for parent, child in edges:
+        elements.append(svg_line(*border(nodes[parent], nodes[child]), *border(nodes[child], nodes[parent]), THIN))
+    for label, circled, x, y in nodes:
+        if circled:
+            elements.append(f'<circle cx="{x:.2f}" cy="{y:.2f}" r="{radius(label):.2f}" fill="none" '
+                            f'stroke="black" stroke-width="{THIN}"/>')
+        elements.append(svg_text(label, x, y + text_height / 2, size))
+
+    extents = [(x - (radius(label) if circled else half_width(label)),
+                y - (radius(label) if circled else text_height / 2 + INNER_SEP),
+                x + (radius(label) if circled else half_width(label)),
+                y + (radius(label) if circled else text_height / 2 + INNER_SEP))
+               for label, circled, x, y in nodes]
+    return svg_document(elements, min(e[0] for e in extents), min(e[1] for e in extents),
+                        max(e[2] for e in extents), max(e[3] for e in extents))
+
+
+def number_label(a):
+    a = sym.nsimplify(a)
+    if a.is_Rational and a.q != 1:
+        return f'{a.p}/{a.q}'
+    return str(a)
+
+
+def number_line_inequality(first, last, solution, step=None, label_size=9, point_size=5):
+    """
+    SVG for the number line from first to last shading solution, a tuple of app.parse.Intervals
+    Mirrors tools.number_line_inequality: the ticks and labels app.ticks lays out, a centimetre
+    apart, and each interval as an ultra thick cyan line ending in a bracket, parenthesis or arrow.
+    """
+    layout = ticks.layout(first, last, step)
+
+    def cm(value):
+        return float(value / layout.step) * PT_PER_CM
+
+    # A nudge of .12cm, whatever the step
+    nudge = .12 * PT_PER_CM
+
+    def nudged(value):
+        # Negative labels are nudged left so the digits, not the minus sign, sit under the tick
+        return cm(value) - nudge if value < 0 else cm(value)
+
+    tick = 3.5
+    label_baseline = 3 + INNER_SEP + DIGIT_HEIGHT * label_size
+    point_baseline = 3 + INNER_SEP + DIGIT_HEIGHT * point_size
+
+    left, right = cm(first) - .5 * PT_PER_CM, cm(last) + .5 * PT_PER_CM
+    elements = [svg_line(left, 0, right, 0, THICK),
+                svg_arrow_tip(left, 0, -1, THICK), svg_arrow_tip(right, 0, 1, THICK)]
+    elements += [svg_line(cm(value), -tick, cm(value), tick, THICK) for value in layout.ticks]
+    elements += [svg_text(text.replace('-', '−'), nudged(value), label_baseline, label_size)
+                 for value, text in layout.labels]
+
+    labelled = {value for value, _ in layout.labels}
+    for end in sorted({end for interval in solution for end in (interval.low, interval.high)
+                       if end is not None and first <= end <= last and end not in labelled}):
+        elements.append(svg_text(number_label(end).replace('-', '−'), nudged(end), point_baseline, point_size))
+
+    for interval in solution:
+        if (interval.high is not None and interval.high < first) or (interval.low is not None and interval.low > last):
+            continue
+        if interval.low is None or interval.low < first:
+            start = cm(first) - .53 * PT_PER_CM
+            start_tip = svg_arrow_tip(start, 0, -1, ULTRA_THICK, 'cyan')
+        else:
+            start = cm(interval.low) - .03 * PT_PER_CM
+            start_tip = svg_bracket_tip(start, 0, 1, ULTRA_THICK, interval.low_closed, 'cyan')
+        if interval.high is None or interval.high > last:
+            end = cm(last) + .53 * PT_PER_CM
+            end_tip = svg_arrow_tip(end, 0, 1, ULTRA_THICK, 'cyan')
+        else:
+            end = cm(interval.high) + .03 * PT_PER_CM
+            end_tip = svg_bracket_tip(end, 0, -1, ULTRA_THICK, interval.high_closed, 'cyan')
+        elements += [svg_line(start, 0, end, 0, ULTRA_THICK, 'cyan'), start_tip, end_tip]
+
+    reach = 3.5 + 3 * ULTRA_THICK
+    return svg_document(elements, min(left, cm(first) - .53 * PT_PER_CM) - reach, -(2.5 + 1.5 * ULTRA_THICK),
+                        max(right, cm(last) + .53 * PT_PER_CM) + reach, label_baseline + 2)
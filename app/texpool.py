@@ -0,0 +1,250 @@
+import atexit
+import os
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+
+from app import metrics
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows, where compiles only have their timeouts
+    resource = None
+
+
+class TexError(Exception):
+    """Raised when a document fails to compile"""
+
+
+class TexTimeout(TexError):
+    """Raised when a compile runs past the pool's per-job timeout"""
+
+
+class TexLimitExceeded(TexError):
+    """Raised when a compile is killed for going over its CPU, memory or output limits"""
+
+
+class TexQueueFull(TexError):
+    """Raised when a pool already has as many jobs waiting as it is allowed to queue"""
+
+
+class TexWorkerPool(object):
+    """
+    Long lived TeX workers sharing one template, compiling with engine (see app.engines)
+    The template's preamble is dumped once into a format file with mylatexformat, so each
+    compile loads pgfplots/forest/tikz from the format instead of parsing them again.
+    Jobs go through a bounded queue to `size` worker threads, and every compile is killed
+    after `timeout` seconds per figure. Each process also runs under rlimits: as many seconds
+    of CPU, max_memory bytes of address space and max_output bytes in any file it writes.
+    If the format can't be dumped, or the engine can't load one, the workers fall back to
+    parsing the full preamble.
+
+    Everything happens under a private directory in `scratch` (ideally a tmpfs). Each job
+    compiles in a fresh temporary directory that is removed however the job ends, and its
+    svgs are renamed into the pool's outbox under unique names for the caller to collect.
+    """
+
+    def __init__(self, template, size, depth, timeout, scratch=None, engine=None, max_memory=None, max_output=None):
+        if engine is None:
+            from app.engines import ENGINES
+            engine = ENGINES['xelatex+pdf2svg']
+        self.template = Path(template)
+        self.engine = engine
+        self.preamble = engine.preamble(self.template.read_text())
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.max_output = max_output
+        self.jobs = queue.Queue(maxsize=depth)
+        self.directory = Path(tempfile.mkdtemp(prefix=f'sme_{self.template.stem}_', dir=scratch))
+        self.outbox = self.directory / 'out'
+        self.outbox.mkdir()
+        atexit.register(shutil.rmtree, self.directory, True)
+
+        self.env = os.environ.copy()
+        self.fmt = self._dump_format()
+        if self.fmt is not None:
+            # The trailing separator keeps kpathsea's default format path after ours
+            self.env['TEXFORMATS'] = f'{self.directory}{os.pathsep}{os.environ.get("TEXFORMATS", "")}'
+
+        self.workers = []
+        for index in range(size):
+            worker = threading.Thread(target=self._work, name=f'{self.template.stem}_{index}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _dump_format(self):
+        """Precompiles the template preamble, returns the format name or None on failure"""
+        if not self.engine.dumps_format:
+            return None
+        name = self.template.stem
+        (self.directory / f'{name}.tex').write_text(self.preamble)
+        try:
+            subprocess.run(self.engine.format_command(name), cwd=self.directory, timeout=self.timeout * 4,
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if not (self.directory / f'{name}.fmt').exists():
+            return None
+        return name
+
+    @property
+    def queued(self):
+        return self.jobs.qsize()
+
+    def submit(self, bodies):
+        """
+        Queues a list of TikZ bodies to be compiled together as one multi page document
+        Returns a Future resolving to the svg paths, one per body in order.
+        """
+        future = Future()
+        try:
+            self.jobs.put_nowait((list(bodies), future))
+        except queue.Full:
+            raise TexQueueFull(f'{self.template.stem} queue is full ({self.jobs.maxsize} jobs)')
+        return future
+
+    def render(self, body):
+        return self.submit([body]).result()[0]
+
+    def render_batch(self, bodies):
+        return self.submit(bodies).result()
+
+    def close(self):
+        """Stops the workers once the jobs already queued are done, and removes the pool's directory"""
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            bodies, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            workdir = tempfile.mkdtemp(dir=self.directory)
+            # Cleaned up before the future is settled, so the caller's recording of the job includes it
+            try:
+                result = self._compile(Path(workdir), bodies)
+            except Exception as e:
+                self._cleanup(workdir)
+                future.set_exception(e)
+            else:
+                self._cleanup(workdir)
+                future.set_result(result)
+
+    @staticmethod
+    def _cleanup(workdir):
+        with metrics.stage('cleanup'):
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _compile(self, workdir, bodies):
+        filename = 'job'
+        # The standalone class puts every tikzpicture on a page of its own
+        with open(workdir / f'{filename}.tex', 'w') as file:
+            file.write(self.preamble + "".join(bodies) + "\\end{document}")
+
+        timeout = self.timeout * len(bodies)
+        program, converter = self.engine.binaries
+        self._run(program, self.engine.compile_command(filename, self.fmt), workdir, timeout)
+        if not (workdir / f'{filename}.{self.engine.output}').exists():
+            raise TexError(f'{program} did not produce a {self.engine.output}')
+        self._run(converter, self.engine.convert_command(filename), workdir, timeout)
+
+        # dvisvgm pads page numbers to the same width, pdf2svg doesn't
+        pages = {}
+        for svg in workdir.glob(f'{filename}_*.svg'):
+            page = re.fullmatch(rf'{filename}_(\d+)\.svg', svg.name)
+            if page is not None:
+                pages[int(page.group(1))] = svg
+        if sorted(pages) != list(range(1, len(bodies) + 1)):
+            raise TexError(f'expected {len(bodies)} pages from {converter}, got {len(pages)}')
+
+        collected = []
+        for page in sorted(pages):
+            collected.append(self.outbox / f'{uuid.uuid4().hex}.svg')
+            os.replace(pages[page], collected[-1])
+        return collected
+
+    def _run(self, name, command, workdir, timeout):
+        """Runs one step of a compile under its limits, raising TexTimeout or TexLimitExceeded if it's killed"""
+        limits = rlimits(timeout, self.max_memory, self.max_output)
+        try:
+            with metrics.stage(name):
+                returncode = run_limited(command, limits, cwd=workdir, env=self.env, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            metrics.exited(name, 'timeout')
+            raise TexTimeout(f'{name} ran longer than {timeout}s')
+        metrics.exited(name, returncode)
+        if returncode < 0:
+            killed = signal.Signals(-returncode).name
+            if killed == 'SIGXCPU':
+                raise TexLimitExceeded(f'{name} used more than {timeout}s of CPU time')
+            if killed == 'SIGXFSZ':
+                raise TexLimitExceeded(f'{name} wrote a file bigger than {self.max_output} bytes')
+            raise TexLimitExceeded(f'{name} was killed by {killed}' + (
+                f', it may have run out of its {self.max_memory} bytes of memory' if self.max_memory else ''))
+
+
+# Sets the limits and execs the command, so they're in place before it runs without a preexec_fn,
+# which isn't safe to use from the pool's threads
+PRLIMIT = shutil.which('prlimit')
+PRLIMIT_OPTIONS = {'RLIMIT_CPU': '--cpu', 'RLIMIT_AS': '--as', 'RLIMIT_FSIZE': '--fsize'}
+
+
+def rlimits(cpu, memory=None, output=None):
+    """
+    The rlimits for a child as (name, soft, hard): cpu seconds, memory bytes of address space and
+    output bytes per file, never above the limits this process already has
+    The soft limit sends SIGXCPU or SIGXFSZ, which kill TeX, rather than SIGKILL.
+    """
+    if resource is None:
+        return []
+    limits = [('RLIMIT_CPU', int(cpu) + 1)]
+    if memory:
+        limits.append(('RLIMIT_AS', memory))
+    if output:
+        limits.append(('RLIMIT_FSIZE', output))
+    clamped = []
+    for name, value in limits:
+        _, hard = resource.getrlimit(getattr(resource, name))
+        clamped.append((name, value if hard == resource.RLIM_INFINITY else min(value, hard), hard))
+    return clamped
+
+
+def run_limited(command, limits, timeout, **kwargs):
+    """
+    Runs command under limits from rlimits, killing it after timeout seconds, and returns its exit code
+    Through prlimit when it's installed, otherwise the limits are set with resource.prlimit
+    as soon as the child is spawned.
+    """
+    if limits and PRLIMIT:
+        options = ['%s=%d:%s' % (PRLIMIT_OPTIONS[name], soft, 'unlimited' if hard == resource.RLIM_INFINITY else hard)
+                   for name, soft, hard in limits]
+        command = [PRLIMIT] + options + ['--'] + list(command)
+    with subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                          **kwargs) as process:
+        if limits and not PRLIMIT:
+            try:
+                for name, soft, hard in limits:
+                    resource.prlimit(process.pid, getattr(resource, name), (soft, hard))
+            except (OSError, AttributeError):
+                # Gone already, or no prlimit outside Linux, and the timeout still applies
+                pass
+        try:
+            return process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
@@ -0,0 +1,83 @@
+"""
+Ticks for number lines: a nice step for the range, and which ticks are labelled
+Steps are 1, 2 or 5 times a power of ten, decimals included. A line gets a tick per integer
+when that makes at least MIN_TICKS and at most max_ticks of them, the smallest step up to
+max_ticks for a wider range, and the largest decimal step making MIN_TICKS for a narrower one.
+Ticks are a centimetre apart, and when the labels are too wide for that only every 2nd,
+5th, 10th, ... tick is labelled, so a figure is about the same size whatever its range.
+"""
+from collections import namedtuple
+
+import sympy as sym
+
+MIN_TICKS = 5
+MAX_TICKS = 41
+# Width of a character of a \small label, and the least gap between two labels, in centimetres
+CHAR_WIDTH = .19
+LABEL_GAP = .2
+
+Layout = namedtuple('Layout', ['step', 'ticks', 'labels'])
+
+
+def nice(scale):
+    """1, 2 and 5 times scale"""
+    return scale, 2 * scale, 5 * scale
+
+
+def count(first, last, step):
+    """How many multiples of step lie between first and last"""
+    return int(sym.floor(last / step) - sym.ceiling(first / step)) + 1
+
+
+def step_for(first, last, max_ticks=MAX_TICKS):
+    """The nice step for a line from first to last, see the module docstring"""
+    first, last = sym.Rational(first), sym.Rational(last)
+    if count(first, last, 1) >= MIN_TICKS:
+        scale = sym.Integer(1)
+        while True:
+            for step in nice(scale):
+                if count(first, last, step) <= max_ticks:
+                    return step
+            scale *= 10
+    scale = sym.Rational(1, 10)
+    while True:
+        for step in reversed(nice(scale)):
+            if count(first, last, step) >= MIN_TICKS:
+                return step
+        scale /= 10
+
+
+def decimals(step):
+    """Digits after the point that the multiples of a nice step need"""
+    places = 0
+    while not (step * 10 ** places).is_integer:
+        places += 1
+    return places
+
+
+def label(value, places):
+    """A tick's value as a decimal with places digits after the point"""
+    if places == 0:
+        return str(value)
+    digits = str(abs(value * 10 ** places)).rjust(places + 1, '0')
+    return ('-' if value < 0 else '') + digits[:-places] + '.' + digits[-places:]
+
+
+def layout(first, last, step=None, max_ticks=MAX_TICKS):
+    """
+    The ticks of a line from first to last with step, or the nice step for it
+    Returns the step, every tick's value, and the (value, text) of the labelled ones.
+    """
+    first, last = sym.Rational(first), sym.Rational(last)
+    step = step_for(first, last, max_ticks) if step is None else sym.Rational(step)
+    start = sym.ceiling(first / step)
+    ticks = [(start + k) * step for k in range(count(first, last, step))]
+
+    places = decimals(step)
+    texts = [label(value, places) for value in ticks]
+    widest = max(map(len, texts), default=0) * CHAR_WIDTH + LABEL_GAP
+    every = next(every for scale in (10 ** k for k in range(len(ticks) + 1)) for every in nice(scale)
+                 if every >= widest)
+    # Labelled ticks are the multiples of every * step, so 0 is always labelled when it's on the line
+    labels = [(value, text) for value, text in zip(ticks, texts) if (value / step) % every == 0]
+    return Layout(step, ticks, labels)
@@ -1,8 +1,13 @@
 # coding=utf-8
 import sympy as sym
-from math import sqrt
 from sympy.core.function import _coeff_isneg
-import random
+from app import digits
+from app import factor
+from app import memo
+from app import plotting
+from app import polynomial
+from app import ticks
+from app.polynomial import DensePoly, divide, horner, is_number, long_division, number_latex, power_latex
 
 def sgn(a, lead=False):
     if lead:
@@ -32,11 +37,11 @@ def constant_sign(x, leading=False):
     etc.
     """
     if x >= 0 and not leading:
-        return " + %s" % sym.latex(x)
+        return " + %s" % number_latex(x)
     elif x >= 0 and leading:
-        return sym.latex(x)
+        return number_latex(x)
     elif x < 0:
-        return sym.latex(x)
+        return number_latex(x)
 
 
 def pmsign(x, leading=False):
@@ -50,6 +55,10 @@ def pmsign(x, leading=False):
     constant_sign(x / 2) gives "+ \frac{x}{2}"
     etc.
     """
+    if leading and is_number(x):
+        if abs(x) == 1:
+            return "" if x > 0 else "-"
+        return number_latex(x)
     x = sym.sympify(x)
     if leading:
         if abs(x) == 1:
@@ -67,58 +76,45 @@ def coefficients(p, x=sym.symbols('x')):
     finds the coefficients of a polynomial p
     returns them as a list from the constant upward
     """
-    r = p
-    l = []
-    while r != 0:
-        l.append(r.subs(x, 0))
-        r = sym.simplify((r - r.subs(x, 0)) / x)
-    return l
+    if p == 0:
+        return []
+    return sym.Poly(p, x).all_coeffs()[::-1]
 
 
 def poly_slicer(poly, first_n_terms=None, show_zeros=True, ghost_terms=True, underline=False,
                 x=sym.symbols('x')):
-    """Helper Function for Polynomial long division"""
+    """
+    Helper Function for Polynomial long division
+    poly may be an expression or, to avoid converting it again, a DensePoly
+    """
+    poly = DensePoly.from_expr(poly, x)
+    x = poly.x
     if show_zeros:
-        terms = sym.Poly(poly, x).all_terms()
+        terms = poly.all_terms()
     else:
-        terms = sym.Poly(poly, x).terms()
+        terms = poly.terms()
 
     first_n_terms = len(terms) if (first_n_terms is None or first_n_terms > len(terms)) else first_n_terms
 
-    if underline:
-        if len(terms) == 1 and terms[0][0][0] == 0:
-            first_term = constant_sign(terms[0][1], leading=True)
-        else:
-            first_term = pmsign(terms[0][1], leading=True)
-        poly_string = f"\\underline{{ \\left({first_term}{sym.latex(x ** terms[0][0][0])}"
-
-        for term in terms[1:first_n_terms]:
-            poly_string += f"{constant_sign(term[1])}" \
-                           f"{sym.latex(x ** term[0][0]) if term[0][0] != 0 else ''}"
-
-        poly_string += " \\right)}"
+    if len(terms) == 1 and terms[0][0] == 0:
+        first_term = constant_sign(terms[0][1], leading=True)
     else:
-        if len(terms) == 1 and terms[0][0][0] == 0:
-            first_term = constant_sign(terms[0][1], leading=True)
-        else:
-            first_term = pmsign(terms[0][1], leading=True)
-        poly_string = f"{first_term}" \
-                      f"{sym.latex(x ** terms[0][0][0]) if terms[0][0][0] != 0 else ''}"
+        first_term = pmsign(terms[0][1], leading=True)
+    poly_string = first_term + power_latex(x, terms[0][0]) \
+                  + "".join(constant_sign(c) + power_latex(x, k) for k, c in terms[1:first_n_terms])
 
-        for term in terms[1:first_n_terms]:
-            poly_string += f"{constant_sign(term[1])}" \
-                           f"{sym.latex(x ** term[0][0]) if term[0][0] != 0 else ''}"
+    if underline:
+        poly_string = f"\\underline{{ \\left({poly_string} \\right)}}"
 
     if ghost_terms:
-        poly_string += f"\\phantom{{ {'{{}}' if not underline else ''} "
-        for term in terms[first_n_terms:]:
-            poly_string += f"{constant_sign(term[1])}" \
-                           f"{sym.latex(x ** term[0][0]) if term[0][0] != 0 else ''}"
-        poly_string += " }"
+        poly_string += f"\\phantom{{ {'{{}}' if not underline else ''} " \
+                       + "".join(constant_sign(c) + power_latex(x, k) for k, c in terms[first_n_terms:]) \
+                       + " }"
 
     return poly_string
 
 
+@memo.results.memoize
 def poly_long_division(n, d, x=sym.symbols('x')):
     """
     function n / d:
@@ -132,76 +128,90 @@ def poly_long_division(n, d, x=sym.symbols('x')):
     return (q, r)
     :return: LaTeX for polynomial long division n / d
     """
-    n = sym.Poly(n, x)
-    d = sym.Poly(d, x)
+    n = DensePoly.from_expr(n, x)
+    d = DensePoly.from_expr(d, x)
 
-    q = sym.div(n, d)[0]
+    q, steps = long_division(n, d)
 
     long_div_string = f"\\require{{enclose}}" \
                       f"\\begin{{array}}{{r}}" \
                       f"{sym.latex(q.as_expr())} \\\\[-3pt] " \
                       f"{sym.latex(d.as_expr())} \\enclose{{longdiv}}{{{poly_slicer(n)}}}"
 
-    term_length = len(d.all_terms())
-
-    q = 0
-    r = n
-    while r != 0 and sym.degree(r) >= sym.degree(d):
-        t = sym.LT(r) / sym.LT(d)
-        q = q + t
-        r = r - t * d
+    term_length = len(d.coeffs)
 
-        if r == 0 or sym.degree(r) < sym.degree(d):
-            long_div_string += f"\\\\[-3pt] -{poly_slicer(t * d, first_n_terms=term_length, underline=True)}" \
+    for t, r in steps:
+        if r.is_zero() or r.degree < d.degree:
+            long_div_string += f"\\\\[-3pt] -{poly_slicer(t, first_n_terms=term_length, underline=True)}" \
                                f"\\\\[-3pt] {poly_slicer(r, show_zeros=False)}"
         else:
-            long_div_string += f"\\\\[-3pt] -{poly_slicer(t * d, first_n_terms=term_length, underline=True)}" \
+            long_div_string += f"\\\\[-3pt] -{poly_slicer(t, first_n_terms=term_length, underline=True)}" \
                                f"\\\\[-3pt] {poly_slicer(r, first_n_terms=term_length)}"
 
     return f"$${long_div_string} \\end{{array}}$$"
 
 
-def synthetic_division(f, g):
-    x = sym.symbols('x')
-    f = sym.Poly(f, x)
-    g = sym.Poly(g, x)
-
-    coeffs_f = f.all_coeffs()
-    coeffs_g = g.all_coeffs()
-    d = -coeffs_g[1]
+def synthetic_array(r, coeffs, row, lead=1):
+    """
+    LaTeX array for the synthetic division of coeffs by x - r with bottom row row
+    For a divisor ax - b, r is b/a and lead is a, and a last row divides the quotient by a.
+    """
+    second_row = [r * b for b in row[:-1]]
 
-    ret = "\\begin{array}{" + "r" * (len(coeffs_f) + 1) + "}"
+    ret = "\\begin{array}{" + "r" * (len(coeffs) + 1) + "}"
+    ret += "\\fbox{$%s$} & " % number_latex(r) + " & ".join([number_latex(c) for c in coeffs]) + " \\\\ "
+    ret += "&& " + " & ".join([number_latex(c) for c in second_row]) + " \\\\ \\hline "
+    ret += "& " + " & ".join([number_latex(c) for c in row[:-1]]) + "& \\fbox{$%s$}" % number_latex(row[-1])
+    if lead != 1:
+        ret += " \\\\ \\div %s & " % number_latex(lead) + \
+            " & ".join([number_latex(divide(b, lead)) for b in row[:-1]]) + " &"
+    return ret + " \\end{array}"
 
-    first_row = [d] + coeffs_f
-    first_row_string = "\\fbox{$%s$} & " % d + " & ".join([str(c) for c in coeffs_f])
 
-    third_row = [coeffs_f[0]]
-    second_row = []
-    for k in range(len(coeffs_f) - 1):
-        second_row.append(d * third_row[k])
-        third_row.append(coeffs_f[k + 1] + d * third_row[k])
+@memo.results.memoize
+def synthetic_division(f, g):
+    """Synthetic division of f by a divisor x - c, or ax - b"""
+    x = sym.symbols('x')
+    f = DensePoly.from_expr(f, x)
+    g = DensePoly.from_expr(g, x)
 
-    second_row_string = "&& " + " & ".join([str(c) for c in second_row])
-    third_row_string = "& " + " & ".join([str(c) for c in third_row[:-1]]) + "& \\fbox{$%s$}" % third_row[-1]
+    lead, constant = g.coeffs
+    r = divide(-constant, lead)
+    return synthetic_array(r, f.coeffs, horner(f.coeffs, r), lead)
 
-    ret += first_row_string + " \\\\ " + second_row_string + " \\\\ \\hline " + third_row_string + " \\end{array}"
 
+@memo.results.memoize
+def rational_roots(f):
+    """
+    The rational root theorem's candidates for f, then synthetic division by each rational root in turn
+    A repeated root is divided out as many times as it repeats.
+    """
+    x = sym.symbols('x')
+    f = DensePoly.from_expr(f, x)
+    candidates, steps = polynomial.rational_roots(f.coeffs)
+
+    ret = ""
+    coeffs = polynomial.integer_coefficients(f.coeffs)
+    if coeffs != f.coeffs:
+        ret += "$$\\text{Clearing fractions: } %s$$" % sym.latex(DensePoly(coeffs, x).as_expr())
+    if candidates:
+        ret += "$$\\text{Possible rational roots: } %s$$" % ", ".join(
+            "\\pm " + number_latex(r) for r in candidates if r > 0)
+    for r, row in steps:
+        ret += "$$%s$$" % synthetic_array(r, coeffs, row)
+        coeffs = row[:-1]
+    if steps:
+        ret += "$$\\text{Rational roots: } %s$$" % ", ".join(number_latex(r) for r, _ in steps)
+    else:
+        ret += "$$\\text{No rational roots}$$"
     return ret
 
 
-def num_digit(n, k):
-    if len(str(n)) > k:
-        return int(str(n)[len(str(n)) - k - 1])
-    return 0
-
-
+@memo.results.memoize
 def vertical_addition(*addends):
     addends = sorted(list(addends), reverse=True)
     total = [digit for digit in str(sum(addends))]
-    carries = [0] * (max([len(str(addend)) for addend in addends]) + 1)
-
-    for k in range(len(carries) - 2, -1, -1):
-        carries[k] = int((carries[k + 1] + sum([num_digit(addend, len(carries) - 2 - k) for addend in addends])) / 10)
+    carries = digits.carries(addends) + [0]
 
     carries = ["" if carry == 0 else str(carry) for carry in carries]
 
@@ -223,18 +233,7 @@ def vertical_addition(*addends):
     return vert_add
 
 
-def dig(n, i):
-    """
-    returns the digit in the 10^i 's place of n
-    :param n:
-    :param i:
-    :return:
-    """
-    if n < 10 ** i:
-        return 0
-    return int(int(n) // (10 ** i)) % 10
-
-
+@memo.results.memoize
 def int_long_division(a, d):
     """
     :param a: Some whole number
@@ -253,69 +252,39 @@ def int_long_division(a, d):
         sb = ["\\underline{%s}" % (q * d)]
         sr = [a % d]
     else:
-        b = [d * dig(q, i) for i in range(n)]
-
-        r = [d % a] * n
-        r[n - 1] = int(a // (10 ** (n - 2))) - (b[n - 1] * 10)
-        for i in range(n - 2, -1, -1):
-            r[i] = (r[i + 1] - b[i]) * 10 + dig(a, i - 1)
-        r[0] = int(r[0] // 10)
+        # Row k from the top subtracts the product for the quotient digit in the 10^(n - 1 - k) place
+        steps, remainder = digits.long_division(a, d)
+        partials = [partial for partial, _ in steps[1:]] + [remainder]
 
         sb = []
-        for bb in b:
-            if len(str(bb)) > 1:
-                sb.append(str(bb))
+        sr = []
+        for k, ((_, product), partial) in enumerate(zip(steps, partials)):
+            place = n - 1 - k
+            if place == 0:
+                sb.append("\\underline{%s}" % product)
             else:
-                sb.append("0" + str(bb))
+                sb.append("\\underline{" + str(product).rjust(2, "0") + "\\phantom{0}" + "}"
+                          + "\\phantom{0}" * (place - 1))
+            sr.append(str(partial) + "\\phantom{0}" * (place - 1))
 
-        sb = ["\\underline{" + sb[i] + "\\phantom{0}" + "}" + "\\phantom{0}" * (i - 1) for i in range(n)]
-        sr = [str(r[i]) + "\\phantom{0}" * (i - 1) for i in range(n)]
-
-        sb[0] = "\\underline{%s}" % str(b[0])
-
-    for i in range(1, n + 1):
-        ret += "%s \\\\[-3pt] %s \\\\[-3pt]" % (sb[n - i], sr[n - i])
+    for i in range(n):
+        ret += "%s \\\\[-3pt] %s \\\\[-3pt]" % (sb[i], sr[i])
     ret += "\\end{array}$$"
 
     return ret.replace("{00\\", "{0\\")
 
 
+@memo.results.memoize
 def vertical_subtraction(a, b):
-    a_digits = [int(digit) for digit in str(a)]
-    b_digits = [int(digit) for digit in str(b)]
+    history = digits.borrows(a, b)
     c_digits = [digit for digit in str(a - b)]
 
-    borrows = [""] * len(a_digits)
-    double_borrows = [""] * len(a_digits)
-    b_zeros = [0] * (len(a_digits) - len(b_digits)) + b_digits
-
-    for i in range(1, len(a_digits)):
-        if b_zeros[i] > a_digits[i]:
-            borrows[i] = a_digits[i] + 10
-            borrows[i - 1] = a_digits[i - 1] - 1
-
-    new_a = [borrow if borrow != "" else a_dig for (a_dig, borrow) in zip(a_digits, borrows)]
-    for i in range(1, len(a_digits)):
-        if b_zeros[i] > new_a[i]:
-            double_borrows[i] = new_a[i] + 10
-            double_borrows[i - 1] = new_a[i - 1] - 1
-
-    for k in range(len(borrows)):
-        if borrows[k] == "" and double_borrows[k] != "":
-            borrows[k] = double_borrows[k]
-            double_borrows[k] = ""
-
-    borrows = ["\\vphantom{\\cancel{0}} %s" % borrow if dborrow == ""
-               else "\\overset{\\scriptstyle %s}{\\cancel{%s}}" % (dborrow, borrow)
-               for (dborrow, borrow) in zip(double_borrows, borrows)]
-
-    a_digits = [str(digit) for digit in str(a)]
+    a_digits = ["\\;%s\\;" % values[0] if len(values) == 1
+                else "\\overset{\\vphantom{\\cancel{0}} %s}{\\cancel{%s}}" % (values[1], values[0]) if len(values) == 2
+                else "\\overset{\\overset{\\scriptstyle %s}{\\cancel{%s}}}{\\cancel{%s}}" % (values[2], values[1], values[0])
+                for values in history]
     b_digits = [str(digit) for digit in str(b)]
 
-    a_digits = ["\\;%s\\;" % digit if borrow == "\\vphantom{\\cancel{0}} "
-                else "\\overset{%s}{\\cancel{%s}}" % (borrow, digit)
-                for (borrow, digit) in zip(borrows, a_digits)]
-
     spacing = "\\phantom{0} \\; " * (len(str(a)) - len(str(b)))
 
     vert_sub = "$$\\require{cancel}\\begin{align}" + "".join(a_digits) + "\\\\" \
@@ -327,106 +296,65 @@ def vertical_subtraction(a, b):
 
 
 def create_graph(f, left=-8, right=8):
+    """
+    pgfplots axis with f, or each of a tuple of functions, plotted from left to right
+    The curves are sampled in Python by app.plotting and handed over as coordinates.
+    """
     ret = "\\begin{tikzpicture}" \
           "\\begin{axis}[standard]" \
           "\\path(axis cs:0,0) node[anchor=north east] {0}; " \
-          "\\addplot[<->,ultra thick, color=blue, samples=150, domain=%s:%s]{%s};" \
+          "%s" \
           "\\end{axis}" \
-          "\\end{tikzpicture}" % (left, right, str(f).replace("**", "^"))
+          "\\end{tikzpicture}" % plotting.pgfplots_plots(f, left, right)
 
     return ret
 
 
 def factor_tree(number):
-    global tree_text
-    tree_text = ""
-
-    def prime_factors_recursive(n, level):
-        """Finds the prime factors of 'n' and generates text representation
-             according to tikz forest package.
-        """
-        limit = int(sqrt(n)) + 1
-        divisor = 2
-        num = n
-        level += 1
-        global tree_text
-        tree_text = tree_text + "["
-        for divisor in range(2, limit):
-            if num % divisor == 0:
-                num /= divisor
-                tree_text = tree_text + "%d [%d,circle, draw] " % (n, divisor)
-                return n, (divisor, prime_factors_recursive(num, level))
-        tree_text = tree_text + "%d,circle,draw" % n
-        for i in range(level):
-            tree_text = tree_text + "]"
-        return n,
-
-    prime_factors_recursive(number, 0)
-    output = r'\begin{forest}' + tree_text + r'\end{forest}'
-    return output
-
-
-def number_line_inequality(first, last, a, relation):
-    negticks = ""
-    ticks = ""
-
-    for i in range(int(first), int(last) + 1):
-        if i < 0:
-            negticks += "%s," % i
-        else:
-            ticks += "%s," % i
-
-    if negticks != "":
-        negticks = negticks[:-1]
-    if ticks != "":
-        ticks = ticks[:-1]
+    """Forest LaTeX for the factor tree of number"""
+    return r'\begin{forest}' + factor.forest(factor.factor_tree(number)) + r'\end{forest}'
 
-    point = ""
-    if int(sym.sympify(a)) != a:
-        if a < 0:
-            point = "\\draw[shift={(%s-.12,-3pt)},color=black] node[below] {\\tiny $%s$};" % (a, sym.latex(a))
-        else:
-            point = "\\draw[shift={(%s,-3pt)},color=black] node[below] {\\tiny $%s$};" % (a, sym.latex(a))
 
-    if relation == ">" or relation == ">=":
-        if relation == ">=":
-            paren = "["
+def number_line_inequality(first, last, solution, step=None):
+    """
+    TikZ number line from first to last shading solution, a tuple of app.parse.Intervals
+    app.ticks picks the step and which ticks are labelled when step isn't given. There is a
+    centimetre between ticks whatever the step, and positions are measured from first, keeping
+    them within TeX's largest dimension however big or small the numbers are.
+    """
+    layout = ticks.layout(first, last, step)
+
+    def x(value):
+        return float((value - first) / layout.step)
+
+    def nudged(value):
+        # Negative labels are nudged left so the digits, not the minus sign, sit under the tick
+        return x(value) - .12 if value < 0 else x(value)
+
+    labelled = {value for value, _ in layout.labels}
+    points = "".join("\\node[below] at (%g,-3pt) {\\tiny $%s$};" % (nudged(end), sym.latex(end))
+                     for end in sorted({end for interval in solution for end in (interval.low, interval.high)
+                                        if end is not None and first <= end <= last and end not in labelled}))
+
+    rays = ""
+    for interval in solution:
+        if (interval.high is not None and interval.high < first) or (interval.low is not None and interval.low > last):
+            continue
+        if interval.low is None or interval.low < first:
+            left, start = "latex", x(first) - .53
         else:
-            paren = "("
-        line = "\\begin{tikzpicture}" \
-               "\\draw[latex-latex, thick] (%s, 0) -- (%s, 0);" \
-               "\\foreach \\x in  {%s}" \
-               "\\draw[shift={(\\x,0)},color=black,thick] (0pt,3.5pt) -- (0pt,-3.5pt);" \
-               "\\foreach \\x in  {%s}" \
-               "\\draw[shift={(\\x,0)},color=black,thick] (0pt,3.5pt) -- (0pt,-3.5pt);" \
-               "\\foreach \\x in {%s}" \
-               "\\draw[shift={(\\x-.12,-3pt)},color=black, thick] node[below] {\\small $\\x$};" \
-               "\\foreach \\x in {%s}" \
-               "\\draw[shift={(\\x,-3pt)},color=black, thick] node[below] {\\small $\\x$};" \
-               "%s" \
-               "\\draw[{%s-latex}, ultra thick, color=cyan] (%s,0) -- (%s,0);" \
-               "\\end{tikzpicture}" % (
-               first - .5, last + .5, negticks, ticks, negticks, ticks, point, paren, a - .03, last + .53)
-
-    else:
-        if relation == "<=":
-            paren = "]"
+            left, start = "[" if interval.low_closed else "(", x(interval.low) - .03
+        if interval.high is None or interval.high > last:
+            right, end = "latex", x(last) + .53
         else:
-            paren = ")"
-        line = "\\begin{tikzpicture}" \
-               "\\draw[latex-latex, thick] (%s, 0) -- (%s, 0);" \
-               "\\foreach \\x in  {%s}" \
-               "\\draw[shift={(\\x,0)},color=black,thick] (0pt,3.5pt) -- (0pt,-3.5pt);" \
-               "\\foreach \\x in  {%s}" \
-               "\\draw[shift={(\\x,0)},color=black,thick] (0pt,3.5pt) -- (0pt,-3.5pt);" \
-               "\\foreach \\x in {%s}" \
-               "\\draw[shift={(\\x-.12,-3pt)},color=black, thick] node[below] {\\small $\\x$};" \
-               "\\foreach \\x in {%s}" \
-               "\\draw[shift={(\\x,-3pt)},color=black, thick] node[below] {\\small $\\x$};" \
-               "%s" \
-               "\\draw[{latex-%s}, ultra thick, color=cyan] (%s,0) -- (%s,0);" \
-               "\\end{tikzpicture}" % (first - .5, last + .5, negticks, ticks, negticks, ticks, point,
-                                       paren, first - .53, a + .03)
-
-    return line
-
+            right, end = "]" if interval.high_closed else ")", x(interval.high) + .03
+        rays += "\\draw[{%s-%s}, ultra thick, color=cyan] (%g,0) -- (%g,0);" % (left, right, start, end)
+
+    return "\\begin{tikzpicture}" \
+           "\\draw[latex-latex, thick] (%g, 0) -- (%g, 0);" \
+           "\\foreach \\x in {%s}{\\draw[color=black,thick] (\\x,3.5pt) -- (\\x,-3.5pt);}" \
+           "\\foreach \\p/\\l in {%s}{\\node[below] at (\\p,-3pt) {\\small $\\l$};}" \
+           "%s%s" \
+           "\\end{tikzpicture}" % (x(first) - .5, x(last) + .5, ",".join("%g" % x(value) for value in layout.ticks),
+                                   ",".join("%g/%s" % (nudged(value), text) for value, text in layout.labels),
+                                   points, rays)
@@ -0,0 +1,200 @@
+"""
+Bulk worksheets of random problems with answer keys, streamed as they are generated
+Problem n of a worksheet is drawn from its own Random seeded with (seed, kind, n), so a
+worksheet is the same however it is split across processes, and any problem can be
+regenerated on its own. Problems are made in chunks on a process pool, a few chunks
+ahead of what has been written out, so memory stays flat however many are asked for.
+Random problems are never asked for twice, so the tools are called around their memos.
+"""
+import json
+import multiprocessing
+import random
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import sympy as sym
+
+from app import factor
+from app import tools
+
+x = sym.symbols('x')
+
+
+def unmemoized(function):
+    return getattr(function, '__wrapped__', function)
+
+
+def polynomial(rng, degree):
+    coeffs = [rng.randint(1, 5)] + [rng.randint(-9, 9) for _ in range(degree)]
+    return sum((c * x ** (degree - k) for k, c in enumerate(coeffs)), sym.Integer(0))
+
+
+def divided(n, d):
+    return "$\\left(%s\\right) \\div \\left(%s\\right)$" % (sym.latex(n), sym.latex(d))
+
+
+def int_long_div(rng):
+    d = rng.randint(2, 99)
+    a = d * rng.randint(10, 9999) + rng.randrange(d)
+    return "$%d \\div %d$" % (a, d), unmemoized(tools.int_long_division)(a, d)
+
+
+def poly_long_div(rng):
+    n = polynomial(rng, rng.randint(3, 4))
+    d = x ** rng.randint(1, 2) + rng.choice([-1, 1]) * rng.randint(1, 5)
+    return divided(n, d), unmemoized(tools.poly_long_division)(n, d)
+
+
+def synth_div(rng):
+    n = polynomial(rng, rng.randint(3, 5))
+    d = x - rng.choice([-1, 1]) * rng.randint(1, 5)
+    # Unlike the other tools its array comes without math delimiters
+    return divided(n, d), "\\[%s\\]" % unmemoized(tools.synthetic_division)(n, d)
+
+
+def vert_add(rng):
+    addends = [rng.randint(100, 99999) for _ in range(rng.randint(2, 3))]
+    return "$%s$" % " + ".join(map(str, addends)), unmemoized(tools.vertical_addition)(*addends)
+
+
+def vert_sub(rng):
+    a = rng.randint(1000, 99999)
+    b = rng.randint(100, a)
+    return "$%d - %d$" % (a, b), unmemoized(tools.vertical_subtraction)(a, b)
+
+
+def factor_tree(rng):
+    n = 1
+    while n < 12:
+        n = 1
+        for _ in range(rng.randint(2, 5)):
+            n *= rng.choice([2, 2, 3, 3, 5, 7, 11, 13])
+    primes = factor.prime_factors(n)
+    # As tools.factor_tree draws it, without filling factor.factor_tree's cache
+    tree = r'\begin{forest}' + factor.forest(unmemoized(factor.factor_tree)(n)) + r'\end{forest}'
+    return "Draw a factor tree for $%d$" % n, tree + "\n\n$%d = %s$" % (n, " \\cdot ".join(map(str, primes)))
+
+
+# Each kind of problem as a function from a Random to LaTeX for the question and its answer
+KINDS = {
+    'int_long_div': int_long_div,
+    'poly_long_div': poly_long_div,
+    'synth_div': synth_div,
+    'vert_add': vert_add,
+    'vert_sub': vert_sub,
+    'factor_tree': factor_tree,
+}
+
+
+def problem(kind, seed, number):
+    """The question and answer for problem number of the worksheet"""
+    return KINDS[kind](random.Random(f'{seed}:{kind}:{number}'))
+
+
+def chunk(kind, seed, start, stop):
+    return [(number,) + problem(kind, seed, number) for number in range(start, stop)]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor(processes):
+    """A process pool shared by every worksheet, spawned for the same reasons as the render jobs'"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def problems(kind, count, seed=0, processes=1, chunk_size=64):
+    """
+    Yields (number, question, answer) for problems 0 to count - 1, in order
+    With more than one process, up to 2 * processes chunks are generated ahead of the one
+    being yielded, and whatever is still in flight is cancelled if the caller stops early.
+    """
+    if processes < 2 or count <= chunk_size:
+        for number in range(count):
+            yield (number,) + problem(kind, seed, number)
+        return
+
+    pool = executor(processes)
+    starts = iter(range(0, count, chunk_size))
+    pending = deque()
+    try:
+        for start in starts:
+            pending.append(pool.submit(chunk, kind, seed, start, min(start + chunk_size, count)))
+            if len(pending) >= 2 * processes:
+                break
+        while pending:
+            done = pending.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                pending.append(pool.submit(chunk, kind, seed, start, min(start + chunk_size, count)))
+            yield from done
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+PREAMBLE = r"""\documentclass{article}
+\usepackage{amsmath}
+\usepackage{cancel}
+\usepackage{forest}
+\usepackage[margin=2cm]{geometry}
+% The tools write for MathJax, \require loads its extensions and \enclose{longdiv} draws the division bracket
+\providecommand{\require}[1]{}
+\newcommand{\enclose}[2]{\,\overline{\smash{)}\,#2}}
+\begin{document}
+"""
+
+TITLES = {
+    'int_long_div': 'Long Division',
+    'poly_long_div': 'Polynomial Long Division',
+    'synth_div': 'Synthetic Division',
+    'vert_add': 'Addition',
+    'vert_sub': 'Subtraction',
+    'factor_tree': 'Factor Trees',
+}
+
+
+def for_latex(answer):
+    """
+    An answer as the tools write it for MathJax, made fit for LaTeX
+    MathJax takes an align inside $$, but to amsmath align is a display of its own, so the $$ go,
+    and it is starred so the answers aren't numbered like equations.
+    """
+    if answer.startswith('$$') and answer.endswith('$$') and '\\begin{align}' in answer:
+        answer = answer[2:-2]
+    return answer.replace('\\begin{align}', '\\begin{align*}').replace('\\end{align}', '\\end{align*}')
+
+
+def latex_document(kind, problems):
+    """
+    Yields a LaTeX worksheet piece by piece, the problems followed by their answer key
+    Answers are spooled to a temporary file while the questions go out, so only the
+    current chunk is ever held in memory.
+    """
+    yield PREAMBLE
+    yield "\\section*{%s}\n\\begin{enumerate}\n" % TITLES[kind]
+    with tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+', encoding='utf-8') as answers:
+        for number, question, answer in problems:
+            yield "\\item %s\n" % question
+            answers.write("\\item %s\n" % for_latex(answer))
+        yield "\\end{enumerate}\n\\newpage\n\\section*{Answers}\n\\begin{enumerate}\n"
+        answers.seek(0)
+        while True:
+            text = answers.read(1 << 16)
+            if not text:
+                break
+            yield text
+    yield "\\end{enumerate}\n\\end{document}\n"
+
+
+def json_lines(kind, problems):
+    """Yields one json object per problem with its number, question and answer"""
+    for number, question, answer in problems:
+        yield json.dumps({'kind': kind, 'number': number, 'question': question, 'answer': answer}) + '\n'
@@ -0,0 +1,83 @@
+"""
+Measures how long a fresh worker takes to start serving
+Every run is a new interpreter, like a cold worker: it times importing the app,
+the first request for the index page and the first request that needs a tool,
+with and without PRELOAD, then breaks the import down by module with -X importtime.
+
+    python benchmarks/startup.py [--runs 5] [--top 15] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+client.get('/')
+index = time.perf_counter()
+client.get('/api/v1/int_long_div?dividend=1234&divisor=7')
+tool = time.perf_counter()
+print(json.dumps({'import': imported - start, 'index': index - start, 'first_tool': tool - start}))
+'''
+
+
+def run(code, env=None, args=()):
+    return subprocess.run([sys.executable, *args, '-c', code], cwd=ROOT, env=dict(os.environ, **(env or {})),
+                          capture_output=True, text=True, check=True)
+
+
+def cold_starts(runs, preload):
+    """Median seconds from interpreter start to each milestone in PROBE"""
+    env = {'PRELOAD': '1' if preload else '0', 'MEMO_DIR': ''}
+    samples = [json.loads(run(PROBE, env).stdout) for _ in range(runs)]
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def import_times(top):
+    """Cumulative import time of the app's own modules and the biggest third party packages, in seconds"""
+    lines = run('import app', {'PRELOAD': '0'}, ['-X', 'importtime']).stderr.splitlines()
+    modules = {}
+    for line in lines:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        # Nested imports are indented, only top level packages and app modules are reported
+        if name.startswith('app') or '.' not in name:
+            modules[name] = max(modules.get(name, 0), int(cumulative) / 1e6)
+    return dict(sorted(modules.items(), key=lambda item: -item[1])[:top])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    results = {'lazy': cold_starts(args.runs, False), 'preload': cold_starts(args.runs, True),
+               'modules': import_times(args.top)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('%-10s %10s %10s %12s' % ('', 'import', 'index', 'first tool'))
+    for mode in ('lazy', 'preload'):
+        times = results[mode]
+        print('%-10s %9.0fms %9.0fms %11.0fms' % (mode, times['import'] * 1000, times['index'] * 1000,
+                                                  times['first_tool'] * 1000))
+    print('\nimport time by module, cumulative')
+    for name, seconds in results['modules'].items():
+        print('%-30s %8.1fms' % (name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Benchmarks every tool across input sizes, and the image and api routes end to end
+Each tool is swept over the size that drives its cost: polynomial degree, digit count,
+the magnitude of the number to factor, the width of a number line, the number of
+functions plotted. Inputs come from a seeded generator, so runs are comparable, and the
+tools' results cache and the factor tree memo are bypassed. The routes run against
+stand-ins for xelatex and pdf2svg that write one blank page per figure, so the whole
+pipeline is timed without TeX.
+
+Results are written as json. Given a baseline from an earlier run, every point is compared
+against it and slowdowns beyond the threshold are reported as regressions.
+
+    python benchmarks/suite.py [--out results.json] [--baseline old.json] [--threshold .25]
+                               [--only factor_tree ...] [--quick] [--fail-on-regression]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+XELATEX = '''#!PYTHON
+import sys, time
+time.sleep(LATENCY)
+source = sys.argv[-1]
+if source.endswith('.tex'):
+    with open(source) as f:
+        text = f.read()
+    pages = text.count('\\\\begin{tikzpicture}') + text.count('\\\\begin{forest}')
+    with open(source[:-4] + '.pdf', 'w') as f:
+        f.write('page\\n' * pages)
+'''
+
+PDF2SVG = '''#!PYTHON
+import sys
+with open(sys.argv[1]) as f:
+    pages = len(f.readlines())
+for page in range(1, pages + 1):
+    with open(sys.argv[2] % page, 'w') as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+'''
+
+
+def stub_tex(directory, latency):
+    """Puts fake xelatex and pdf2svg first on the PATH"""
+    for name, script in (('xelatex', XELATEX), ('pdf2svg', PDF2SVG)):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(script.replace('PYTHON', sys.executable).replace('LATENCY', repr(latency)))
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = directory + os.pathsep + os.environ['PATH']
+
+
+def measure(call, min_time=.2, min_runs=3, max_runs=2000):
+    """Calls call() until min_time has passed and at least min_runs were made, timing each"""
+    times = []
+    while len(times) < min_runs or (sum(times) < min_time and len(times) < max_runs):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {'runs': len(times), 'median': median, 'min': min(times), 'per_second': 1 / median if median else None}
+
+
+# Input generators, each taking a seeded Random and the size
+
+def number(rng, digits):
+    return rng.randint(10 ** (digits - 1), 10 ** digits - 1)
+
+
+def polynomial(rng, degree):
+    import sympy as sym
+    x = sym.symbols('x')
+    coeffs = [rng.choice([-1, 1]) * rng.randint(1, 9)] + [rng.randint(-9, 9) for _ in range(degree)]
+    return sum(c * x ** (degree - k) for k, c in enumerate(coeffs))
+
+
+def rooted(rng, degree):
+    """A polynomial with degree rational roots p/q, p and q below 10"""
+    import sympy as sym
+    x = sym.symbols('x')
+    return sym.expand(sym.Mul(*[rng.randint(1, 9) * x - rng.randint(-9, 9) for _ in range(degree)]))
+
+
+def inequality(rng, width):
+    """Text of x outside or between two quarters, or on one side of one, within a line of width"""
+    import sympy as sym
+    first = -(width // 2)
+    a, b = sorted(sym.Rational(rng.randint(4 * first, 4 * (first + width)), 4) for _ in range(2))
+    return rng.choice([f'x < {a} or x >= {b}', f'{a} <= x < {b}' if a < b else f'x > {a}',
+                       f'x {rng.choice(["<", "<=", ">", ">="])} {a}'])
+
+
+def number_line(rng, width):
+    from app import parse
+    first = -(width // 2)
+    return first, first + width, parse.parse_inequality(inequality(rng, width))
+
+
+def functions(rng, count):
+    import sympy as sym
+    x = sym.symbols('x')
+    shapes = [lambda k: sym.sin(k * x), lambda k: x ** 2 / k - k, lambda k: 1 / (x - k), lambda k: sym.sqrt(x + k),
+              lambda k: sym.exp(x / k) - k]
+    return sym.Tuple(*[rng.choice(shapes)(rng.randint(1, 5)) for _ in range(count)])
+
+
+def polylines(svg):
+    """Every polyline's points as floats, to the thousandth minify keeps"""
+    return [[round(float(value), 3) for value in points.replace(',', ' ').split()]
+            for points in re.findall(r'<polyline[^>]*\bpoints="([^"]*)"', svg)]
+
+
+def graph_svg(rng, count):
+    """A plot as the renderer stores it, checking minify leaves its curves as they were"""
+    from app import plotting
+    from app.minify import minify
+    svg = plotting.svg_graph(functions(rng, count)).encode('utf-8')
+    before, after = polylines(svg.decode('utf-8')), polylines(minify(svg).decode('utf-8'))
+    assert before and all(before), 'no curve was plotted'
+    assert after == before, 'minify changed the curves of a plot'
+    return (svg,)
+
+
+def tool_cases():
+    """name: (function, what the size is, sizes, args(rng, size))"""
+    import sympy as sym
+    from app import factor
+    from app import plotting
+    from app import svg
+    from app import tools
+    from app.minify import minify
+
+    def unmemoized(function):
+        return getattr(function, '__wrapped__', function)
+
+    def uncached(function, memoized):
+        """function with what memoized remembers forgotten before every call, for drawing from factor.factor_tree"""
+        def call(*args):
+            memoized.cache_clear()
+            return function(*args)
+        return call
+
+    x = sym.symbols('x')
+    return {
+        'poly_long_division': (unmemoized(tools.poly_long_division), 'degree', [2, 8, 16, 32, 64],
+                               lambda rng, n: (polynomial(rng, n), polynomial(rng, max(1, n // 4)))),
+        'synthetic_division': (unmemoized(tools.synthetic_division), 'degree', [2, 8, 16, 32, 64],
+                               lambda rng, n: (polynomial(rng, n), x - rng.randint(-9, 9))),
+        'rational_roots': (unmemoized(tools.rational_roots), 'degree', [2, 4, 8, 16],
+                           lambda rng, n: (rooted(rng, n),)),
+        'int_long_division': (unmemoized(tools.int_long_division), 'digits', [2, 10, 100, 1000],
+                              lambda rng, n: (number(rng, n), number(rng, max(1, n // 4)))),
+        'vertical_addition': (unmemoized(tools.vertical_addition), 'digits', [2, 10, 100, 1000],
+                              lambda rng, n: tuple(number(rng, n) for _ in range(3))),
+        'vertical_subtraction': (unmemoized(tools.vertical_subtraction), 'digits', [2, 10, 100, 1000],
+                                 lambda rng, n: tuple(sorted([number(rng, n), number(rng, n)], reverse=True))),
+        'factor_tree': (uncached(tools.factor_tree, factor.factor_tree), 'digits', [3, 6, 12, 18, 24],
+                        lambda rng, n: (number(rng, n),)),
+        'number_line_inequality': (tools.number_line_inequality, 'width', [1, 10, 100, 10 ** 6], number_line),
+        'create_graph': (tools.create_graph, 'functions', [1, 2, 4], lambda rng, n: (functions(rng, n),)),
+        'svg.factor_tree': (uncached(svg.factor_tree, factor.factor_tree), 'digits', [3, 6, 12, 18, 24],
+                            lambda rng, n: (number(rng, n),)),
+        'svg.number_line_inequality': (svg.number_line_inequality, 'width', [1, 10, 100, 10 ** 6], number_line),
+        'plotting.svg_graph': (plotting.svg_graph, 'functions', [1, 2, 4], lambda rng, n: (functions(rng, n),)),
+        'minify.svg_graph': (minify, 'functions', [1, 2, 4], graph_svg),
+    }
+
+
+def bench_tools(only, quick, seed, inputs=8):
+    results = {}
+    for name, (function, parameter, sizes, make) in tool_cases().items():
+        if only and name not in only:
+            continue
+        points = []
+        for size in sizes[:2] if quick else sizes:
+            rng = random.Random(f'{seed}:{name}:{size}')
+            batch = [make(rng, size) for _ in range(inputs)]
+            turn = iter(range(1 << 62))
+            points.append(dict(size=size, **measure(lambda: function(*batch[next(turn) % len(batch)]),
+                                                    min_time=.05 if quick else .2)))
+        results[name] = {'parameter': parameter, 'points': points}
+    return results
+
+
+def route_cases(client):
+    """name: (what the size is, sizes, call(rng, size)), every call asks for something not yet cached"""
+
+    def api(rng, digits):
+        response = client.get('/api/v1/int_long_div', query_string={'dividend': number(rng, digits),
+                                                                    'divisor': number(rng, max(1, digits // 4))})
+        assert response.status_code == 200, response.data
+
+    def batch(tool, renderer, inputs):
+        def call(rng, size):
+            response = client.post(f'/batch/{tool}', json=[dict(inputs(rng), renderer=renderer) for _ in range(size)])
+            assert response.status_code == 200, response.data
+        return call
+
+    def factor_tree_input(rng):
+        return {'function': str(number(rng, 9))}
+
+    def number_line_input(rng):
+        return {'first': -10, 'last': 10, 'relation': inequality(rng, 20)}
+
+    def jobs(rng, concurrent):
+        """Submits through the form like the page does, then polls every job until its image is ready"""
+        urls = []
+        for _ in range(concurrent):
+            page = client.post('/factor_tree', data={'function': number(rng, 9), 'renderer': 'tex'},
+                               follow_redirects=True).get_data(as_text=True)
+            urls.append(re.findall(r'data-job=(\S+)>', page)[-1])
+        while urls:
+            status = client.get(urls[0]).get_json()
+            if status['status'] == 'done':
+                urls.pop(0)
+            elif status['status'] == 'pending':
+                time.sleep(.002)
+            else:
+                raise RuntimeError(status)
+
+    return {
+        'route.api.int_long_div': ('digits', [10, 100, 1000], api),
+        'route.batch.factor_tree.tex': ('figures', [1, 10, 50], batch('factor_tree', 'tex', factor_tree_input)),
+        'route.batch.factor_tree.svg': ('figures', [1, 10, 50], batch('factor_tree', 'svg', factor_tree_input)),
+        'route.batch.num_line_inequality.tex': ('figures', [1, 10, 50],
+                                                batch('num_line_inequality', 'tex', number_line_input)),
+        'route.jobs.factor_tree.tex': ('concurrent', [1, 8], jobs),
+    }
+
+
+def bench_routes(only, quick, seed):
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    results = {}
+    for name, (parameter, sizes, call) in route_cases(client).items():
+        if only and name not in only:
+            continue
+        points = []
+        for size in sizes[:2] if quick else sizes:
+            rng = random.Random(f'{seed}:{name}:{size}')
+            call(rng, size)  # warms up worker pools and processes
+            points.append(dict(size=size, **measure(lambda: call(rng, size), min_time=.1 if quick else .5)))
+        results[name] = {'parameter': parameter, 'points': points}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Every point in both runs as (name, size, baseline median, median, ratio), and those slower by more than threshold"""
+    rows = []
+    regressions = []
+    for name, case in results.items():
+        before = {point['size']: point for point in baseline.get(name, {}).get('points', [])}
+        for point in case['points']:
+            if point['size'] in before:
+                ratio = point['median'] / before[point['size']]['median']
+                rows.append((name, point['size'], before[point['size']]['median'], point['median'], ratio))
+                if ratio > 1 + threshold:
+                    regressions.append(rows[-1])
+    return rows, regressions
+
+
+def metadata(seed):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'time': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'commit': commit or None,
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'seed': seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--out', help='where to write the results json, by default stdout')
+    parser.add_argument('--baseline', help='results json of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=.25, help='slowdown reported as a regression')
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    parser.add_argument('--quick', action='store_true', help='only the two smallest sizes, with fewer runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tex-latency', type=float, default=0, help='seconds each stub xelatex run sleeps')
+    parser.add_argument('--no-routes', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 if anything regressed')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='sme-bench-')
+    stub_tex(scratch, args.tex_latency)
+    # Rendered images go to a store of their own, removed afterwards
+    renders = tempfile.mkdtemp(prefix='sme-bench-renders-')
+    # Set before the app is imported, and inherited by the render processes
+    os.environ.update(RENDER_STORE='disk', RENDER_CACHE_DIR=renders, MEMO_DIR='', PRELOAD='0',
+                      TEX_ENGINE='xelatex+pdf2svg', TEX_ENGINES='', TEX_ENGINE_BENCHMARK='')
+    sys.path.insert(0, ROOT)
+
+    try:
+        results = bench_tools(args.only, args.quick, args.seed)
+        if not args.no_routes:
+            results.update(bench_routes(args.only, args.quick, args.seed))
+    finally:
+        shutil.rmtree(renders, ignore_errors=True)
+        shutil.rmtree(scratch, ignore_errors=True)
+    report = {'meta': metadata(args.seed), 'results': results}
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows, regressions = compare(results, json.load(f)['results'], args.threshold)
+        for name, size, before, after, ratio in rows:
+            flag = '  REGRESSION' if ratio > 1 + args.threshold else ''
+            print('%-38s %6s %10.3fms %10.3fms %6.2fx%s' % (name, size, before * 1000, after * 1000, ratio, flag),
+                  file=sys.stderr)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()